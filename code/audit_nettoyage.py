@@ -0,0 +1,63 @@
+import os
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+"""Stockage (au format Parquet) des diagnostics du nettoyage des données.
+
+Au lieu d'écrire plusieurs petits fichiers par commune (csv des commentaires, des adresses ip identiques ...), chaque table
+de diagnostics est écrite dans un seul fichier Parquet (audit_fold/<table>.parquet), complété par lots successifs (un groupe
+de lignes Parquet par lot). Les lots étant écrits dans l'ordre des communes, les lignes d'une même commune sont contiguës :
+la lecture des diagnostics d'une commune (read_audit(..., insee=...)) ne lit que les groupes de lignes qui la contiennent,
+grâce aux statistiques (min/max) de chaque groupe."""
+
+
+class AuditStore:
+    def __init__(self, audit_fold, commune_column="insee"):
+        """ENTREES :
+            - audit_fold (str) : dossier des tables (les tables existantes sont remplacées)
+            - commune_column (str) : colonne des tables associée à la commune"""
+        self.audit_fold = audit_fold
+        self.commune_column = commune_column
+        self.writers = {}
+        self.empty_tables = {}  # tables dont tous les lots sont vides jusqu'ici
+        os.makedirs(audit_fold, exist_ok=True)
+
+    def append(self, table_name, df):
+        """Ajoute un lot de lignes (pd.DataFrame) à la table table_name. Le schéma de la table est fixé par le premier lot."""
+        df = df.reset_index(drop=True)
+        if len(df) == 0:  # un lot vide ne fixe pas le schéma (les colonnes de texte vides n'ont pas de type)
+            if table_name not in self.writers:
+                self.empty_tables[table_name] = df
+            return
+        if self.commune_column in df.columns:
+            df[self.commune_column] = df[self.commune_column].astype(str)  # même type quel que soit le type des codes insee
+        writer = self.writers.get(table_name)
+        if writer is None:
+            table = pa.Table.from_pandas(df, preserve_index=False)
+            writer = pq.ParquetWriter(os.path.join(self.audit_fold, f"{table_name}.parquet"), table.schema)
+            self.writers[table_name] = writer
+        else:
+            table = pa.Table.from_pandas(df, schema=writer.schema, preserve_index=False)
+        writer.write_table(table)
+
+    def close(self):
+        for writer in self.writers.values():
+            writer.close()
+        for table_name, df in self.empty_tables.items():
+            if table_name not in self.writers:
+                pq.write_table(pa.Table.from_pandas(df, preserve_index=False),
+                               os.path.join(self.audit_fold, f"{table_name}.parquet"))
+        self.writers, self.empty_tables = {}, {}
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+
+def read_audit(audit_fold, table_name, insee=None, columns=None, commune_column="insee"):
+    """Lit une table de diagnostics, éventuellement restreinte à une commune (code insee) et à certaines colonnes."""
+    filters = [(commune_column, "==", str(insee))] if insee is not None else None
+    return pd.read_parquet(os.path.join(audit_fold, f"{table_name}.parquet"), columns=columns, filters=filters)
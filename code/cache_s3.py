@@ -0,0 +1,88 @@
+import os
+import hashlib
+import tempfile
+
+"""Cache local (sur disque) des fichiers téléchargés depuis le S3.
+
+Chaque fichier est stocké sous un nom dérivé du triplet (bucket, clé, ETag) : tant que l'objet n'est pas modifié sur le S3,
+son ETag ne change pas et le fichier local est réutilisé. Lorsque l'objet est modifié, son ETag change, une nouvelle entrée
+est créée et l'ancienne finit par être supprimée par la politique d'éviction LRU (les fichiers les moins récemment utilisés
+sont supprimés dès que la taille totale du cache dépasse cache_max_size).
+
+L'emplacement et la taille maximale du cache peuvent être modifiés à l'aide des variables d'environnement FUB_CACHE_DIR
+et FUB_CACHE_MAX_SIZE (en octets)."""
+
+cache_dir = os.getenv("FUB_CACHE_DIR", os.path.join(os.path.expanduser("~"), ".cache", "fub_s3"))
+cache_max_size = int(os.getenv("FUB_CACHE_MAX_SIZE", 5 * 1024**3))  # 5 Go par défaut
+
+
+def get_cache_path(bucket_name, key, etag, cache_fold=None):
+    """Renvoie le chemin local associé à un objet du S3. Le nom du fichier est un hash de (bucket, clé, ETag), suivi de
+    l'extension de la clé (ce qui permet à pandas de détecter automatiquement une éventuelle compression)."""
+    cache_fold = cache_dir if cache_fold is None else cache_fold
+    digest = hashlib.sha256(f"{bucket_name}/{key}/{etag.strip(chr(34))}".encode("utf-8")).hexdigest()
+    suffix = "".join(os.path.basename(key).split(".", 1)[1:])
+    file_name = f"{digest}.{suffix}" if suffix else digest
+    return os.path.join(cache_fold, "objects", file_name)
+
+
+def lookup(bucket_name, key, etag, cache_fold=None):
+    """Renvoie le chemin du fichier en cache s'il existe (et le marque comme récemment utilisé), None sinon."""
+    path = get_cache_path(bucket_name, key, etag, cache_fold)
+    if not os.path.exists(path):
+        return None
+    os.utime(path)  # la date de modification sert de date de dernier accès pour l'éviction LRU
+    return path
+
+
+def store(bucket_name, key, etag, stream, cache_fold=None, max_size=None, chunk_size=8 * 1024**2):
+    """Copie le contenu de stream (objet possédant une méthode read, par exemple le Body renvoyé par get_object) dans le cache,
+    par blocs de chunk_size octets, puis applique la politique d'éviction. L'écriture se fait dans un fichier temporaire
+    renommé à la fin, de sorte qu'un téléchargement interrompu ne laisse jamais de fichier incomplet dans le cache.
+    SORTIE :
+        path (str) : chemin du fichier en cache"""
+    path = get_cache_path(bucket_name, key, etag, cache_fold)
+    objects_fold = os.path.dirname(path)
+    os.makedirs(objects_fold, exist_ok=True)
+    fd, tmp_path = tempfile.mkstemp(dir=objects_fold, suffix=".tmp")
+    try:
+        with os.fdopen(fd, "wb") as f:
+            for chunk in iter(lambda: stream.read(chunk_size), b""):
+                f.write(chunk)
+        os.replace(tmp_path, path)
+    except BaseException:
+        os.remove(tmp_path)
+        raise
+    evict(cache_fold, max_size, keep=path)
+    return path
+
+
+def evict(cache_fold=None, max_size=None, keep=None):
+    """Supprime les fichiers les moins récemment utilisés jusqu'à ce que la taille totale du cache soit inférieure à max_size.
+    Le fichier keep (typiquement celui qui vient d'être téléchargé) n'est jamais supprimé."""
+    cache_fold = cache_dir if cache_fold is None else cache_fold
+    max_size = cache_max_size if max_size is None else max_size
+    objects_fold = os.path.join(cache_fold, "objects")
+    if not os.path.isdir(objects_fold):
+        return
+    entries = []
+    for entry in os.scandir(objects_fold):
+        if entry.is_file() and not entry.name.endswith(".tmp"):
+            stat = entry.stat()
+            entries.append((stat.st_mtime, stat.st_size, entry.path))
+    total_size = sum(size for _, size, _ in entries)
+    for _, size, path in sorted(entries):
+        if total_size <= max_size:
+            break
+        if path == keep:
+            continue
+        try:
+            os.remove(path)
+        except FileNotFoundError:  # fichier déjà supprimé par un autre thread ou processus
+            pass
+        total_size -= size
+
+
+def clear(cache_fold=None):
+    """Vide entièrement le cache."""
+    evict(cache_fold, max_size=0)
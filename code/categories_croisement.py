@@ -0,0 +1,80 @@
+import numpy as np
+import pandas as pd
+
+"""Catégories de croisement (tranches d'âge, fréquence de circulation, niveau de pratique ...) dérivées des réponses codées
+du questionnaire du baromètre.
+
+Chaque catégorie est décrite de façon déclarative par la question dont elle dérive et un dictionnaire de classes, associant
+à chaque intitulé un code de réponse ou un intervalle de codes (min, max), bornes incluses. Les classes sont testées dans
+l'ordre du dictionnaire, les réponses manquantes ou hors de toutes les classes n'ont pas de catégorie (NaN), sauf si une
+classe par défaut est précisée (voir recode).
+Le recodage est vectoriel : pour une colonne de type "category" (voir schema_donnees.py), seules les catégories de la colonne
+(quelques codes) sont recodées, puis le résultat est propagé à toutes les réponses par indexation des codes de catégorie.
+Les colonnes produites sont de type "category", dont les catégories sont les intitulés dans l'ordre du dictionnaire."""
+
+# q48 : 0 - Moins de 11 ans; 1- 11-14 ans; 2- 15-18 ans; 3-18 - 24 ans; 4-25 - 34 ans; 5-35 - 44 ans; 6-45 - 54 ans;
+#       7-55 - 64 ans; 8-65 - 75 ans; 9-Plus de 75 ans
+age_groups = {'-11 ans': 0, '11-14 ans': 1, '15-18 ans': 2, '18-24 ans': 3, '25-34 ans': 4, '35-44 ans': 5, '45-54 ans': 6,
+              '54-64 ans': 7, '65-75 ans': 8, '+75 ans': 9}
+wide_age_groups = {'Jeune': (0, 2), 'Adulte': (3, 6), 'Senior': (7, 9)}  # Jeune (0-18ans), Adulte (18-54 ans), Senior (+ 54 ans)
+
+recodes = {
+    "2025": {"age1": ("q48", age_groups),
+             "age2": ("q48", wide_age_groups),
+             "genre": ("q47", {'F': 1, 'M': 2, 'X': 3}),
+             # fréquence de circulation dans la commune (q6)
+             "FCC1": ("q6", {'Tous les jours': 1, '1 à 3 fois par semaine': 2, '1 à 3 fois par mois': 3,
+                             '1 à 3 fois par ans': 4, 'Jamais': 5}),
+             "FCC2": ("q6", {'Quotidiennement': (1, 2), 'Ponctuellement': (3, 4), 'Jamais': 5}),
+             # niveau de pratique (q37), classe agrégée
+             "NiveauPratique": ("q37", {'Débutant': (1, 2), 'Intermédiaire': (3, 4), 'Confirmé': (5, 6)}),
+             # multimodalité, abonnement aux transports en commun (q45), classe agrégée
+             "abonnementTC": ("q45", {'Abonné.e TC': (1, 3), 'Non abonné.e': 4})},
+}
+
+
+def get_class_codes(values, classes, offset=0):
+    """Numéro de la classe (dans l'ordre de classes) de chaque valeur de values (np.array de flottants), -1 si aucune"""
+    values = values - offset
+    conditions = []
+    for bounds in classes.values():
+        low, high = bounds if isinstance(bounds, tuple) else (bounds, bounds)
+        conditions.append((values >= low) & (values <= high))
+    return np.select(conditions, np.arange(len(classes)), -1).astype(np.int8 if len(classes) < 127 else np.int32)
+
+
+def recode(values, classes, offset=0, default=None):
+    """Recode des réponses codées en catégories.
+    ENTREES :
+        - values (pd.Series) : réponses codées (nombres, éventuellement de type "category" ou entier nullable)
+        - classes (dict) : intitulé de chaque classe -> code ou intervalle de codes (min, max), bornes incluses
+        - offset (int) : décalage des codes de values par rapport à ceux de classes (par exemple 1 si les tranches d'âge sont
+            codées de 1 à 10 au lieu de 0 à 9)
+        - default (str ou None) : intitulé (parmi ceux de classes) de la classe des réponses manquantes ou hors de toutes les
+            classes (si None, ces réponses n'ont pas de catégorie)
+    SORTIE :
+        recoded (pd.Series) : catégorie de chaque réponse (type "category", même index que values)"""
+    if isinstance(values.dtype, pd.CategoricalDtype):
+        categories = pd.to_numeric(pd.Series(values.cat.categories), errors="coerce").to_numpy(dtype="float64", na_value=np.nan)
+        category_codes = np.append(get_class_codes(categories, classes, offset), -1)  # code -1 : valeur manquante
+        class_codes = category_codes[values.cat.codes.to_numpy()]
+    else:
+        numeric_values = pd.to_numeric(values, errors="coerce").to_numpy(dtype="float64", na_value=np.nan)
+        class_codes = get_class_codes(numeric_values, classes, offset)
+    if default is not None:
+        class_codes = np.where(class_codes < 0, list(classes).index(default), class_codes).astype(class_codes.dtype)
+    return pd.Series(pd.Categorical.from_codes(class_codes, categories=list(classes)), index=values.index, name=values.name)
+
+
+def apply_recodes(df, recodes_spec):
+    """Ajoute à df les catégories de croisement de recodes_spec.
+    ENTREES :
+        - df (pd.DataFrame) : réponses au questionnaire
+        - recodes_spec (str ou dict) : nom d'une édition ("2025") ou dictionnaire associant à chaque nouvelle colonne un
+            couple (question, classes) (voir recode)
+    SORTIE :
+        df (pd.DataFrame) : le tableau avec les nouvelles colonnes (df est modifié en place)"""
+    recodes_spec = recodes[str(recodes_spec)] if isinstance(recodes_spec, (str, int)) else recodes_spec
+    for column, (question, classes) in recodes_spec.items():
+        df[column] = recode(df[question], classes)
+    return df
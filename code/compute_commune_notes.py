@@ -1,8 +1,8 @@
 from local_paths import your_local_save_fold
 import pandas as pd
 
-from lecture_ecriture_donnees import preview_file, write_csv_on_s3, make_dir
-from utils import get_commune_name_from_insee
+from lecture_ecriture_donnees import preview_file, write_many, make_dir
+from utils import CommuneRegistry
 import numpy as np
 
 
@@ -15,7 +15,7 @@ def compute_notes(df, insee_refs, group_of_questions, save_fold, save_key_s3, co
 
     ENTREES :
     - df (pd.DataFrame) : jeu de données (préférablement nettoyé)
-    - insee_refs (pd.DataFrame). Tableau pandas associant les codes INSEE au nom de commune et autres caractéristiques de la commune
+    - insee_refs (pd.DataFrame ou CommuneRegistry). Tableau pandas associant les codes INSEE au nom de commune et autres caractéristiques de la commune
     - group_of_questions (dict) : dictionnaire dans lequel les clés sont les noms des groupes de questions et les valeurs
             les listes contenant les questions associées
     - save_fold : chemin ou les fichiers csv regoupant les notes sont sauvegardés
@@ -25,54 +25,65 @@ def compute_notes(df, insee_refs, group_of_questions, save_fold, save_key_s3, co
 
     note_tables_columns = ["insee", "Commune", "Nombre de réponses (après filtrage)", "Moyenne des questions", "Moyenne des catégories","Classe", "Type de commune",
                            *group_of_questions.keys()]
-    insee_codes = df[commune_id].unique()
-    types_of_communes = insee_refs[commune_type_id].unique()
-    notes_df = {categorie:pd.DataFrame(columns=note_tables_columns) for categorie in types_of_communes}
-    not_found_insee_codes = []
-    for insee_code in insee_codes:
-        df_commune = df[df[commune_id] == insee_code]
-        nom_commune, categorie, _, not_found = get_commune_name_from_insee(insee_code, insee_refs)
-        if not_found:
-            not_found_insee_codes.append(insee_code)
-        avg_note = df_commune[avg_note_att_name].values.mean()
-        classe = get_class_from_note(avg_note)
-        nouvelle_ligne = [insee_code, nom_commune, len(df_commune), avg_note, classe, categorie]
-        moyennes_catégories = 0
-        for group in group_of_questions.keys():
-            average_note = df_commune[group_of_questions[group]].values.mean()
-            moyennes_catégories += average_note
-            nouvelle_ligne.append(average_note)
-        moyennes_catégories/=len(group_of_questions.keys())
-        nouvelle_ligne.insert(4, moyennes_catégories)
-        if categorie in notes_df.keys():
-            notes_df[categorie].loc[len(notes_df[categorie])] = nouvelle_ligne
-    print("les codes insee suivants n'ont pas été trouvés dans le tableau des communes", not_found_insee_codes)
+    registry = insee_refs if isinstance(insee_refs, CommuneRegistry) else CommuneRegistry(insee_refs)
+    types_of_communes = registry.insee_refs[commune_type_id].unique()
+    notes = get_commune_notes(df, group_of_questions, commune_id, avg_note_att_name)
+    communes = registry.lookup_many(notes.index)  # une seule jointure avec le tableau des communes
+    print("les codes insee suivants n'ont pas été trouvés dans le tableau des communes", notes.index[communes["not_found"].to_numpy()].tolist())
+    notes.insert(0, "Commune", communes["Commune"].to_numpy())
+    moyennes_catégories = 0
+    for group in group_of_questions.keys():
+        moyennes_catégories += notes[group]
+    notes.insert(3, "Moyenne des catégories", moyennes_catégories / len(group_of_questions.keys()))
+    notes.insert(4, "Classe", get_class_from_note(notes["Moyenne des questions"].to_numpy()))
+    notes.insert(5, "Type de commune", communes["Catégorie Baromètre"].to_numpy())
+    notes = notes.rename_axis("insee").reset_index()
+    notes_by_type = dict(list(notes.groupby("Type de commune", sort=False)))
     make_dir(save_fold)
-    for categorie in notes_df.keys():
-        notes_df[categorie] = notes_df[categorie].sort_values(by="Moyenne des questions", ascending=False)
-        notes = notes_df[categorie]
-        notes.to_excel(f"{save_fold}/note_communes_{categorie}.xlsx", index=False)
-        write_csv_on_s3(notes, f"{save_key_s3}/note_communes_{categorie}.csv")
+    notes_df, tables_to_save = {}, {}
+    for categorie in types_of_communes:  # les communes dont la catégorie est inconnue ne sont pas classées
+        if categorie in notes_by_type:
+            notes_df[categorie] = notes_by_type[categorie].reset_index(drop=True).sort_values(by="Moyenne des questions", ascending=False)
+        else:
+            notes_df[categorie] = pd.DataFrame(columns=note_tables_columns)
+        notes_df[categorie].to_excel(f"{save_fold}/note_communes_{categorie}.xlsx", index=False)
+        tables_to_save[f"{save_key_s3}/note_communes_{categorie}.csv"] = notes_df[categorie]
+    write_many(tables_to_save)  # envoi en parallèle des tableaux de toutes les catégories
     return notes_df
 
+
+def get_commune_notes(df, group_of_questions, commune_id="insee", avg_note_att_name="average_note"):
+    """Nombre de réponses, note moyenne et notes moyennes des groupes de questions de chaque commune, en un seul groupby.
+    Comme pour une moyenne numpy, la note d'une commune est NaN si une de ses valeurs l'est.
+    SORTIE :
+        notes (pd.DataFrame) : une ligne par commune (indexée par commune_id, dans l'ordre d'apparition dans df), colonnes
+            "Nombre de réponses (après filtrage)", "Moyenne des questions" et une colonne par groupe de questions"""
+    # somme des notes de chaque groupe de questions par réponse, puis par commune (sommes d'entiers, donc exactes quel que
+    # soit l'ordre de sommation)
+    sums = pd.DataFrame({group: df[questions].to_numpy(dtype="float64", na_value=np.nan).sum(axis=1)
+                         for group, questions in group_of_questions.items()}, index=df.index)
+    communes = df[commune_id].to_numpy()
+    counts = sums.groupby(communes, sort=False).size()
+    notes = sums.groupby(communes, sort=False).sum().mask(sums.isna().groupby(communes, sort=False).any())
+    for group, questions in group_of_questions.items():
+        notes[group] /= counts * len(questions)
+    # la note moyenne n'est pas entière : moyenne numpy des réponses de chaque commune (dans leur ordre d'apparition), pour
+    # retrouver exactement le même arrondi
+    notes.insert(0, avg_note_att_name, df[avg_note_att_name].groupby(communes, sort=False).agg(lambda values: values.to_numpy().mean()))
+    notes.insert(0, "Nombre de réponses (après filtrage)", counts)
+    return notes.rename(columns={avg_note_att_name: "Moyenne des questions"})
+
+
+# bornes des classes G, F, E, D, C, B, A, A+ : une note est dans la classe i si elle est supérieure à i bornes (une note
+# égale à 2.3 est dans la classe F, les autres bornes appartiennent à la classe inférieure, une note NaN est dans la classe A+)
+class_bounds = np.array([np.nextafter(2.3, -np.inf), 2.7, 3.1, 3.5, 3.9, 4.3, 4.6])
+class_names = np.array(["G", "F", "E", "D", "C", "B", "A", "A+"])
+
+
 def get_class_from_note(note):
-    if note < 2.3:
-        classe = "G"
-    elif (note >= 2.3 and note <= 2.7):
-        classe = "F"
-    elif (note >= 2.7 and note <=3.1):
-        classe = "E"
-    elif (note >=3.1 and note <=3.5):
-        classe = "D"
-    elif (note>=3.5 and note <=3.9):
-        classe = "C"
-    elif (note>=3.9 and note<=4.3):
-        classe = "B"
-    elif (note >= 4.3 and note <= 4.6):
-        classe = "A"
-    else:
-        classe = "A+"
-    return classe
+    """Classe associée à une note (ou à un tableau de notes)"""
+    classes = class_names[np.searchsorted(class_bounds, note, side="left")]
+    return classes if np.ndim(note) else str(classes)
 
 def sign(x):
     if x >= 0:
@@ -84,9 +95,10 @@ def sign(x):
 if __name__ == '__main__':
     notes_2021 = preview_file("data/converted/2025/brut/2021 Notes par commune_Classement.csv", csv_sep=",", nrows=None)
     two_editions_notes = []
+    insee_refs = preview_file(key="data/converted/2025/brut/220128_BV_Communes_catégories.csv", csv_sep=",", nrows=None)
+    print('columns insee refs', insee_refs.columns)
+    registry = CommuneRegistry(insee_refs)  # indexé une seule fois pour les deux éditions
     for data_2025 in [True, False]:  # = True si on souhaite utiliser les données de 2025, =False si on souhaite utiliser les données de 2021
-        insee_refs = preview_file(key="data/converted/2025/brut/220128_BV_Communes_catégories.csv", csv_sep=",", nrows=None)
-        print('columns insee refs', insee_refs.columns)
 
         filtered_data_key = "data/converted/2025/nettoyee/250604_Export_Reponses_Final_Result_Nettoyee.csv" if data_2025 else \
                             "data/reproduced/2021/reponses-2021-12-01-08-00-00_filtered_2025_method.csv"
@@ -106,13 +118,14 @@ if __name__ == '__main__':
 
         save_key_s3 = "data/converted/2025/nettoyee" if data_2025 else "data/reproduced/2021"
         save_fold = f"{your_local_save_fold}/barometre_notes_good_data_2/notes_new_method" if data_2025 else f"{your_local_save_fold}/barometre_notes_good_data/notes_2021"
-        notes_df = compute_notes(df, insee_refs, group_of_questions, save_fold, save_key_s3, commune_id)
+        notes_df = compute_notes(df, registry, group_of_questions, save_fold, save_key_s3, commune_id)
         two_editions_notes.append(notes_df)
 
 
     merged_save_fold = f"{your_local_save_fold}/barometre_notes_good_data/merged_2021_2025_2"
     merged_save_fold_s3 = "data/converted/2025/nettoyee/merged_2021_2025"
     make_dir(merged_save_fold)
+    merged_tables_to_save = {}
     for categorie in notes_df.keys():
         merged_notes = two_editions_notes[0][categorie].copy()
         notes_2021_methodo_2025 = two_editions_notes[1][categorie]
@@ -137,7 +150,8 @@ if __name__ == '__main__':
                 merged_notes.loc[merged_notes["insee"] == insee, "Evolution (%)"] = evolution_percentage_str
 
         merged_notes.to_excel(f"{merged_save_fold}/note_communes_{categorie}.xlsx", index=False)
-        write_csv_on_s3(merged_notes, f'{merged_save_fold_s3}/note_communes_{categorie}.csv')
+        merged_tables_to_save[f'{merged_save_fold_s3}/note_communes_{categorie}.csv'] = merged_notes
+    write_many(merged_tables_to_save)
 
 
 
@@ -0,0 +1,91 @@
+import numpy as np
+import pandas as pd
+from utils import CommuneRegistry
+from process_bdd_nettoyee import group_of_questions
+
+"""Cube d'agrégation des notes par commune et par catégories de croisement (genre, tranche d'âge, QPV ...).
+
+Les réponses ne sont parcourues qu'une seule fois : pour chaque cellule (code insee, valeur de chaque catégorie de croisement),
+on calcule le nombre de réponses, la somme et la somme des carrés de chaque mesure (note moyenne, notes des groupes de
+questions). Ces trois quantités étant additives, les agrégats à tous les niveaux géographiques (commune, EPCI, département,
+région, catégorie du baromètre, France entière) et pour tout sous-ensemble des catégories de croisement (ex : genre x région)
+s'obtiennent en sommant les cellules, sans relire les réponses. La moyenne et l'écart-type (écart-type empirique corrigé,
+comme pd.Series.std) s'en déduisent. Les valeurs manquantes d'une catégorie de croisement forment une valeur à part (NaN)."""
+
+crossing_dimensions = ["genre", "age2", "QPV", "FCC2", "NiveauPratique", "abonnementTC"]  # voir categories_croisement.py
+geographic_levels = ["EPCI", "DEP", "REG", "Catégorie Baromètre"]  # colonnes du tableau des communes (voir CommuneRegistry)
+
+
+class CubeCroisements:
+    def __init__(self, df, registry, measures=None, dimensions=crossing_dimensions, commune_id="insee"):
+        """ENTREES :
+            - df (pd.DataFrame) : réponses, avec les mesures et les catégories de croisement (par exemple la base traitée
+                renvoyée par build_processed, voir process_bdd_nettoyee.py)
+            - registry (CommuneRegistry ou pd.DataFrame) : tableau des communes, pour les niveaux géographiques
+            - measures (list de str) : colonnes à agréger (par défaut la note moyenne et les notes des groupes de questions)
+            - dimensions (list de str) : catégories de croisement
+            - commune_id (str) : colonne associée à la commune"""
+        registry = registry if isinstance(registry, CommuneRegistry) else CommuneRegistry(registry)
+        self.measures = ["average_note", *group_of_questions.keys()] if measures is None else list(measures)
+        self.dimensions, self.commune_id = list(dimensions), commune_id
+        values = df[self.measures].to_numpy(dtype="float64", na_value=np.nan)
+        valid = ~np.isnan(values)
+        values = np.where(valid, values, 0)
+        stats = pd.DataFrame(np.hstack([valid, values, values**2]), index=df.index,
+                             columns=pd.MultiIndex.from_product([["count", "sum", "sumsq"], self.measures]))
+        # codes INSEE comparés sous forme de chaînes, comme dans build_processed (colonnes lues en int ou en str)
+        insee_codes = df[commune_id].astype(str)
+        # un seul groupby sur (commune, catégories de croisement) pour toutes les mesures
+        self.cells = stats.groupby([insee_codes, *[df[dimension] for dimension in self.dimensions]],
+                                   observed=True, dropna=False).sum()
+        # types nullables (Int64, string) : les codes (REG, DEP ...) absents ne transforment pas les entiers en flottants (11.0)
+        communes = registry.by_insee.convert_dtypes()
+        communes = communes.set_axis(communes.index.astype(str))
+        self.communes = communes[~communes.index.duplicated()].reindex(self.cells.index.unique(level=0))
+
+    def rollup(self, level=None, by=()):
+        """Agrège le cube à un niveau géographique, éventuellement croisé avec des catégories de croisement.
+        ENTREES :
+            - level (str ou None) : commune_id (communes), "EPCI", "DEP", "REG", "Catégorie Baromètre" (ou toute autre colonne du
+                tableau des communes), ou None (France entière)
+            - by (list ou tuple de str) : catégories de croisement (parmi dimensions)
+        SORTIE :
+            stats (pd.DataFrame) : une ligne par groupe (index : level et by), et pour chaque mesure les colonnes
+                (mesure, "Nombre de réponses"), (mesure, "Moyenne"), (mesure, "Ecart-type")
+        ex : cube.rollup("REG", by=["genre"]) : notes par région et par genre"""
+        insee_codes = self.cells.index.get_level_values(0)
+        keys = []
+        if level == self.commune_id:
+            keys.append(insee_codes)
+        elif level is not None:
+            keys.append(pd.Index(self.communes[level].reindex(insee_codes), name=level))
+        keys += [self.cells.index.get_level_values(dimension) for dimension in by]
+        sums = self.cells.groupby(keys, observed=True, dropna=False).sum() if keys else self.cells.sum().to_frame("France").T
+        return get_statistics(sums, self.measures)
+
+
+def get_statistics(sums, measures):
+    """Nombre de réponses, moyenne et écart-type de chaque mesure, à partir des nombres, sommes et sommes des carrés sums"""
+    columns = {}
+    for measure in measures:
+        count, total, total_sq = sums[("count", measure)], sums[("sum", measure)], sums[("sumsq", measure)]
+        with np.errstate(invalid="ignore", divide="ignore"):
+            mean = total / count
+            variance = np.maximum(total_sq - total * mean, 0) / (count - 1)
+        columns[(measure, "Nombre de réponses")] = count.astype(int)
+        columns[(measure, "Moyenne")] = mean
+        columns[(measure, "Ecart-type")] = np.sqrt(variance).where(count > 1)
+    return pd.DataFrame(columns)
+
+
+if __name__ == '__main__':
+    from lecture_ecriture_donnees import preview_file
+    from process_bdd_nettoyee import processed_keys
+
+    processed = preview_file(processed_keys[0])
+    insee_refs = preview_file(key="data/converted/2025/brut/220128_BV_Communes_catégories.csv", csv_sep=",", nrows=None)
+    cube = CubeCroisements(processed, insee_refs)
+    print('Nombre de cellules du cube', len(cube.cells), 'pour', len(processed), 'réponses')
+    for level in geographic_levels:
+        print(cube.rollup(level)["average_note"].head())
+    print(cube.rollup("REG", by=["genre"])["average_note"].head())
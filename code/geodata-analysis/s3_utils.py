@@ -1,9 +1,14 @@
 import os
+import hashlib
+import tempfile
 import boto3
 import geopandas as gpd
-from io import StringIO
+from io import BytesIO
 from dotenv import load_dotenv
 
+# dossier du cache local des fichiers géographiques convertis en GeoParquet
+geo_cache_dir = os.path.join(os.getenv("FUB_CACHE_DIR", os.path.join(os.path.expanduser("~"), ".cache", "fub_s3")), "geo")
+
 class S3Manager:
     load_dotenv()
     def __init__(self, region="eu-west-3"):
@@ -15,24 +20,61 @@ class S3Manager:
             aws_secret_access_key=os.getenv("SCW_SECRET_KEY")
         )
 
-    def list_bucket_contents(self, bucket_name):
+    def list_bucket_contents(self, bucket_name, prefix=""):
         try:
-            result = self.s3.list_objects_v2(Bucket=bucket_name)
-            if "Contents" in result:
+            # list_objects_v2 renvoie au plus 1000 objets par appel : on parcourt toutes les pages
+            paginator = self.s3.get_paginator("list_objects_v2")
+            keys = [obj["Key"] for page in paginator.paginate(Bucket=bucket_name, Prefix=prefix)
+                    for obj in page.get("Contents", [])]
+            if keys:
                 print("Voici les objets présents dans le bucket :")
-                for obj in result["Contents"]:
-                    print(f"- {obj['Key']}")
+                for key in keys:
+                    print(f"- {key}")
             else:
                 print("Le bucket est vide ou inaccessible.")
+            return keys
         except Exception as e:
             print(f"❌ Erreur lors de la lecture du bucket : {e}")
 
-    def load_geojson_from_s3(self, bucket_name, s3_key):
-        try:
-            response = self.s3.get_object(Bucket=bucket_name, Key=s3_key)
-            geojson_data = response['Body'].read().decode('utf-8')
+    def get_geoparquet_path(self, bucket_name, s3_key, row_group_size=2000):
+        """Renvoie le chemin d'une copie locale au format GeoParquet du fichier GeoJSON s3_key.
+        La conversion n'est faite qu'une fois par version du fichier (le nom de la copie dépend de l'ETag de l'objet).
+        Les géométries sont triées selon une courbe de Hilbert et écrites par groupes de row_group_size lignes, avec une
+        colonne de boîtes englobantes : chaque groupe couvre ainsi une petite zone, et un filtre par boîte englobante
+        ne lit que les groupes qui l'intersectent (index spatial grossier)."""
+        etag = self.s3.head_object(Bucket=bucket_name, Key=s3_key)["ETag"].strip('"')
+        digest = hashlib.sha256(f"{bucket_name}/{s3_key}/{etag}".encode("utf-8")).hexdigest()
+        path = os.path.join(geo_cache_dir, f"{digest}.parquet")
+        if not os.path.exists(path):
+            response = self.s3.get_object(Bucket=bucket_name, Key=s3_key, IfMatch=etag)
+            gdf = gpd.read_file(BytesIO(response['Body'].read()))
+            has_geometry = gdf.geometry.notna() & ~gdf.geometry.is_empty
+            hilbert = gdf.geometry[has_geometry].hilbert_distance().reindex(gdf.index)
+            gdf = gdf.loc[hilbert.sort_values(kind="stable", na_position="last").index]
+            os.makedirs(geo_cache_dir, exist_ok=True)
+            fd, tmp_path = tempfile.mkstemp(dir=geo_cache_dir, suffix=".tmp")
+            os.close(fd)
+            gdf.to_parquet(tmp_path, write_covering_bbox=True, row_group_size=row_group_size)
+            os.replace(tmp_path, path)
+        return path
 
-            gtp_commune_m = gpd.read_file(StringIO(geojson_data))
+    def load_geojson_from_s3(self, bucket_name, s3_key, bbox=None, filters=None, columns=None):
+        """Charge un fichier GeoJSON du S3 sous forme de GeoDataFrame, en passant par un cache local au format GeoParquet
+        (voir get_geoparquet_path) : seul le premier chargement d'une version du fichier télécharge et analyse le GeoJSON.
+        ENTREES :
+            - bbox (tuple) : (xmin, ymin, xmax, ymax), si spécifié seules les géométries qui intersectent cette boîte sont lues
+            - filters : filtres sur les attributs, au format de pd.read_parquet. ex : [("DEP", "==", "35")] pour un
+                département, [("REG", "in", ["53", "52"])] pour des régions
+            - columns (list de str) : si spécifié, seules ces colonnes (et la géométrie) sont lues
+        SORTIE :
+            GeoDataFrame dont les lignes sont dans l'ordre du GeoJSON (index : position de la ligne dans le fichier)"""
+        try:
+            path = self.get_geoparquet_path(bucket_name, s3_key)
+            if columns is not None:
+                columns = list(dict.fromkeys([*columns, "geometry"]))  # gpd.read_file nomme toujours la colonne de géométrie "geometry"
+            # le cache est trié selon la courbe de Hilbert, mais son index conserve la position de chaque ligne dans le GeoJSON :
+            # les lignes sont renvoyées dans l'ordre du fichier d'origine
+            gtp_commune_m = gpd.read_parquet(path, columns=columns, bbox=bbox, filters=filters).sort_index()
 
             print("✅ Fichier chargé et converti en GeoDataFrame avec succès")
             return gtp_commune_m
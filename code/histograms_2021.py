@@ -1,6 +1,6 @@
 from local_paths import your_local_save_fold, make_dir
 from lecture_ecriture_donnees import preview_file
-from nettoyage_donnees import get_commune_name_from_insee
+from utils import CommuneRegistry
 import numpy as np
 import matplotlib.pyplot as plt
 
@@ -8,6 +8,7 @@ import matplotlib.pyplot as plt
 
 df = preview_file(key="data/converted/2021/nettoye/Réponses post-fraude_Result 1.csv", csv_sep=",", nrows=None)
 insee_refs = preview_file(key="data/converted/2025/brut/220128_BV_Communes_catégories.csv", csv_sep=",", nrows=None)
+registry = CommuneRegistry(insee_refs)
 
 insee_codes = ["80164", "39198", "94078", "62263"]
 
@@ -19,7 +20,7 @@ save_fold = f"{your_local_save_fold}/histograms/histograms_2021_with_2021_method
 make_dir(save_fold)
 
 for insee_code in insee_codes:
-    nom_commune, _, _ = get_commune_name_from_insee(insee_code, insee_refs)
+    nom_commune, _, _, _ = registry.lookup(insee_code)
     df_commune = df[df["q01"] == insee_code].copy()
     df_commune["average_note"] = df_commune[questions_to_average].mean(axis=1)
 
@@ -3,85 +3,396 @@ import os
 from dotenv import load_dotenv
 import pandas as pd
 import io
-from io import StringIO
+import zlib
+import hashlib
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from botocore.config import Config
 from botocore.exceptions import ClientError
+import cache_s3
+from schema_donnees import apply_schema
 
-# Load environment variables from .env file
-# You need to create a .env file and specify on it the variables AWS_ACCESS_KEY_ID, AWS_SECRET_ACCESS_KEY and AWS_REGION
-# so that they can be loaded by load_doenv
-load_dotenv()
-
-access_key = os.getenv("AWS_ACCESS_KEY_ID")
-secret_key = os.getenv("AWS_SECRET_ACCESS_KEY")
 region = "fr-par" #os.getenv("AWS_REGION")
 endpoint_url = "https://s3.fr-par.scw.cloud"
+max_transfer_workers = 16  # nombre de transferts simultanés pour read_many et write_many
+
+# Le client S3 est créé à la première utilisation (et non à l'import du module), puis partagé au sein du processus.
+# Un nouveau client est créé dans chaque processus fils (les clients boto3 ne doivent pas être partagés entre processus).
+_s3_client = None
+_s3_client_pid = None
+_s3_client_lock = threading.Lock()
+
+def get_s3_client():
+    """Renvoie le client S3 du processus courant, en le créant si nécessaire.
+    Les identifiants sont lus dans les variables d'environnement, éventuellement chargées depuis un fichier .env
+    (il faut créer un fichier .env et y spécifier les variables AWS_ACCESS_KEY_ID et AWS_SECRET_ACCESS_KEY)."""
+    global _s3_client, _s3_client_pid
+    with _s3_client_lock:
+        if _s3_client is None or _s3_client_pid != os.getpid():
+            load_dotenv()
+            _s3_client = boto3.client(
+                "s3",
+                region_name=region,
+                endpoint_url=endpoint_url,
+                aws_access_key_id=os.getenv("AWS_ACCESS_KEY_ID"),
+                aws_secret_access_key=os.getenv("AWS_SECRET_ACCESS_KEY"),
+                # le pool de connexions doit être au moins aussi grand que le nombre de transferts simultanés
+                config=Config(max_pool_connections=2 * max_transfer_workers,
+                              retries={"max_attempts": 10, "mode": "adaptive"}),
+            )
+            _s3_client_pid = os.getpid()
+    return _s3_client
+
+def get_local_copy(key, bucket_name='fub-s3'):
+    """Renvoie le chemin d'une copie locale de l'objet key, en passant par le cache local (voir cache_s3.py).
+    Une requête HEAD (peu coûteuse) est envoyée pour récupérer l'ETag actuel de l'objet : si une copie associée à cet ETag
+    existe déjà dans le cache, elle est utilisée directement, sinon l'objet est téléchargé puis ajouté au cache."""
+    s3 = get_s3_client()
+    etag = s3.head_object(Bucket=bucket_name, Key=key)["ETag"]
+    path = cache_s3.lookup(bucket_name, key, etag)
+    if path is None:
+        obj = s3.get_object(Bucket=bucket_name, Key=key, IfMatch=etag)
+        path = cache_s3.store(bucket_name, key, etag, obj['Body'])
+    return path
+
+csv_extensions = (".csv", ".csv.gz", ".csv.zst")
+
+def get_csv_compression(key):
+    """Renvoie la compression d'un fichier CSV du S3, déduite de l'extension de sa clé ("gzip", "zstd" ou None)."""
+    return "gzip" if key.endswith(".gz") else "zstd" if key.endswith(".zst") else None
+
+def get_parquet_key(key):
+    """Renvoie la clé du miroir Parquet associé à un fichier CSV du S3 (même chemin, extension .parquet)."""
+    return key[:-len(".csv")] + ".parquet"
 
-# Create the S3 client
-s3 = boto3.client(
-    "s3",
-    region_name=region,
-    endpoint_url=endpoint_url,
-    aws_access_key_id=access_key,
-    aws_secret_access_key=secret_key,
-)
-
-def preview_file(key, bucket_name='fub-s3', nrows=None, csv_sep=";", csv_engine="python", quotechar='"', encoding="utf-8"):
-    """Download and preview the first few rows of a CSV or Excel file from S3."""
-    obj = s3.get_object(Bucket=bucket_name, Key=key)
-    file_stream = io.BytesIO(obj['Body'].read())
-    if key.endswith(".csv"):
+def get_fresh_parquet_key(key, bucket_name='fub-s3'):
+    """Renvoie la clé du miroir Parquet du fichier CSV key s'il existe et s'il a été écrit à partir de la version actuelle du
+    CSV, None sinon. convert_to_parquet enregistre l'ETag du CSV converti dans les métadonnées du miroir ("source-etag") :
+    un miroir sans cette métadonnée, ou dont le CSV a été réécrit depuis, n'est pas utilisé."""
+    s3 = get_s3_client()
+    parquet_key = get_parquet_key(key)
+    try:
+        source_etag = s3.head_object(Bucket=bucket_name, Key=parquet_key)["Metadata"].get("source-etag")
+    except ClientError as e:
+        if e.response["Error"]["Code"] not in ("404", "NoSuchKey"):
+            raise
+        return None
+    if source_etag != s3.head_object(Bucket=bucket_name, Key=key)["ETag"]:
+        print(f"Le miroir Parquet {parquet_key} n'est pas à jour, lecture du fichier CSV")
+        return None
+    return parquet_key
+
+def filter_rows(df, filters):
+    """Applique à un DataFrame des filtres sur les lignes exprimés au même format que l'argument filters de pd.read_parquet :
+    une liste de tuples (colonne, opérateur, valeur) combinés par un ET logique, ou une liste de telles listes combinées par
+    un OU logique. Opérateurs acceptés : "==", "=", "!=", "<", ">", "<=", ">=", "in", "not in".
+    ex : [("insee", "in", ["75056", "69123"]), ("q14", ">=", 3)]"""
+    operators = {"==": lambda c, v: c == v, "=": lambda c, v: c == v, "!=": lambda c, v: c != v,
+                 "<": lambda c, v: c < v, ">": lambda c, v: c > v, "<=": lambda c, v: c <= v, ">=": lambda c, v: c >= v,
+                 "in": lambda c, v: c.isin(v), "not in": lambda c, v: ~c.isin(v)}
+    if not filters:
+        return df
+    disjunction = filters if isinstance(filters[0], list) else [filters]
+    mask = pd.Series(False, index=df.index)
+    for conjunction in disjunction:
+        conj_mask = pd.Series(True, index=df.index)
+        for column, op, value in conjunction:
+            conj_mask &= operators[op](df[column], value)
+        mask |= conj_mask
+    return df[mask].reset_index(drop=True)
+
+def get_columns_to_read(columns, filters):
+    """Renvoie les colonnes à lire pour pouvoir appliquer filters puis ne conserver que columns."""
+    if columns is None:
+        return None
+    disjunction = filters if filters and isinstance(filters[0], list) else [filters or []]
+    filter_columns = [column for conjunction in disjunction for column, _, _ in conjunction]
+    return list(dict.fromkeys(columns + filter_columns))
+
+def preview_file(key, bucket_name='fub-s3', nrows=None, csv_sep=";", csv_engine="python", quotechar='"', encoding="utf-8",
+                 use_cache=True, columns=None, filters=None, prefer_parquet=False, schema=None):
+    """Download and preview the first few rows of a CSV or Excel file from S3.
+    Si use_cache vaut True, le fichier est lu depuis le cache local tant qu'il n'a pas été modifié sur le S3.
+    Pour un fichier CSV, si prefer_parquet vaut True et qu'un miroir Parquet à jour du fichier existe sur le S3 (voir
+    convert_to_parquet et get_fresh_parquet_key), c'est ce miroir qui est lu, ce qui est beaucoup plus rapide et permet de ne
+    lire que les colonnes nécessaires. Les types peuvent alors différer de ceux d'une lecture du CSV (colonnes de types mixtes
+    converties en chaînes de caractères, voir serialize_table).
+    columns (list de str) : si spécifié, seules ces colonnes sont lues
+    filters : filtres sur les lignes, au format de pd.read_parquet (voir filter_rows). ex : [("insee", "in", codes_insee)]
+    schema (str ou dict) : si spécifié, types compacts appliqués aux colonnes (voir schema_donnees.py). ex : schema="2025" """
+    s3 = get_s3_client()
+    if columns is not None:
+        columns = list(dict.fromkeys(columns))  # supprime les doublons éventuels en conservant l'ordre
+    parquet_key = get_fresh_parquet_key(key, bucket_name) if key.endswith(".csv") and prefer_parquet else None
+    if parquet_key is not None:
+        return preview_file(parquet_key, bucket_name, nrows=nrows, use_cache=use_cache, columns=columns, filters=filters,
+                            schema=schema)
+    if use_cache:
+        file_stream = get_local_copy(key, bucket_name)
+    else:
+        obj = s3.get_object(Bucket=bucket_name, Key=key)
+        file_stream = io.BytesIO(obj['Body'].read())
+    if key.endswith(".parquet"):
+        df = pd.read_parquet(file_stream, columns=columns, filters=filters)
+        df = df if nrows is None else df.head(nrows)
+        return df if schema is None else apply_schema(df, schema)
+    if key.endswith(csv_extensions):
+        # float_precision="round_trip" : lecture des flottants identique à celle du moteur python
+        engine_options = {"float_precision": "round_trip"} if csv_engine == "c" else {}
         df = pd.read_csv(
             file_stream,
             nrows=nrows,
             sep=csv_sep,
             engine=csv_engine,
             quotechar=quotechar,
-            encoding=encoding
+            encoding=encoding,
+            compression=get_csv_compression(key),
+            usecols=get_columns_to_read(columns, filters),
+            **engine_options
         )
     elif key.endswith((".xlsx", ".xls", ".xlsm")):
-        df = pd.read_excel(file_stream, nrows=nrows)
+        df = pd.read_excel(file_stream, nrows=nrows, usecols=get_columns_to_read(columns, filters))
     else:
         raise ValueError(f"Unsupported file type: {key}")
+    df = filter_rows(df, filters)
+    df = df if columns is None else df[columns].copy()
+    return df if schema is None else apply_schema(df, schema)
+
+def iter_file(key, chunksize=100000, bucket_name='fub-s3', csv_sep=";", quotechar='"', encoding="utf-8", columns=None,
+              filters=None, use_cache=False, prefer_parquet=False):
+    """Lit un fichier CSV (ou Parquet) du S3 par blocs de chunksize lignes, sans jamais charger le fichier entier en mémoire.
+    Pour un fichier CSV, le flux téléchargé depuis le S3 est directement transmis au parser C de pandas (sauf si use_cache vaut
+    True, auquel cas le fichier est d'abord copié dans le cache local puis lu par blocs depuis le disque).
+    Les arguments columns, filters et prefer_parquet ont la même signification que pour preview_file.
+    SORTIE :
+        générateur de pd.DataFrame d'au plus chunksize lignes (avant application de filters)
+    ex :
+        for chunk in iter_file(key, chunksize=50000, csv_sep=","):
+            ..."""
+    s3 = get_s3_client()
+    if columns is not None:
+        columns = list(dict.fromkeys(columns))
+    # un fichier Parquet ne peut être lu par blocs que depuis un fichier à accès aléatoire, d'où le passage par le cache
+    parquet_key = key if key.endswith(".parquet") else \
+        get_fresh_parquet_key(key, bucket_name) if key.endswith(".csv") and prefer_parquet else None
+    if parquet_key is not None:
+        parquet_path = get_local_copy(parquet_key, bucket_name)
+        import pyarrow.parquet as pq
+        parquet_file = pq.ParquetFile(parquet_path)
+        for batch in parquet_file.iter_batches(batch_size=chunksize, columns=get_columns_to_read(columns, filters)):
+            chunk = filter_rows(batch.to_pandas(), filters)
+            yield chunk if columns is None else chunk[columns]
+        return
+    if not key.endswith(csv_extensions):
+        raise ValueError(f"Unsupported file type for chunked reading: {key}")
+    source = get_local_copy(key, bucket_name) if use_cache else s3.get_object(Bucket=bucket_name, Key=key)['Body']
+    reader = pd.read_csv(source, sep=csv_sep, quotechar=quotechar, encoding=encoding, compression=get_csv_compression(key),
+                         usecols=get_columns_to_read(columns, filters), chunksize=chunksize, engine="c",
+                         float_precision="round_trip")
+    with reader:
+        for chunk in reader:
+            chunk = filter_rows(chunk, filters)
+            yield chunk if columns is None else chunk[columns]
+
+def convert_to_parquet(key, bucket_name='fub-s3', csv_sep=";", quotechar='"', encoding="utf-8", schema=None):
+    """Lit un fichier CSV du S3 et en écrit un miroir au format Parquet (même chemin, extension .parquet) sur le S3.
+    Les lectures suivantes de ce fichier avec preview_file(..., prefer_parquet=True) utiliseront ce miroir. L'ETag du CSV
+    converti est enregistré dans les métadonnées du miroir : si le fichier CSV est modifié, le miroir n'est plus utilisé
+    tant que la conversion n'est pas relancée.
+    Si schema est spécifié (voir schema_donnees.py), le miroir est écrit avec les types compacts correspondants."""
+    s3 = get_s3_client()
+    # ETag lu avant la lecture : si le CSV est réécrit pendant la conversion, le miroir est considéré comme périmé
+    source_etag = s3.head_object(Bucket=bucket_name, Key=key)["ETag"]
+    df = preview_file(key, bucket_name, csv_sep=csv_sep, quotechar=quotechar, encoding=encoding, prefer_parquet=False,
+                      schema=schema)
+    parquet_key = get_parquet_key(key)
+    s3.put_object(Bucket=bucket_name, Key=parquet_key, Body=serialize_table(df, parquet_key),
+                  Metadata={"source-etag": source_etag})
+    print(f"File saved on s3 at location {parquet_key}")
 
-    return df
+class _NoCompression:
+    """Compresseur identité, qui a la même interface que les objets renvoyés par zlib.compressobj"""
+    def compress(self, data):
+        return data
 
-def write_csv_on_s3(df, save_path, bucket_name='fub-s3', csv_sep=";", quotechar='"'):
-    # Convert DataFrame to CSV in memory
-    csv_buffer = StringIO()
-    df.to_csv(csv_buffer, index=False, sep=csv_sep, quotechar=quotechar)
-    # Define S3 bucket and file path
-    s3.put_object(Bucket=bucket_name, Key=save_path, Body=csv_buffer.getvalue())
+    def flush(self):
+        return b""
+
+def get_compressor(compression):
+    """Renvoie un compresseur en flux (méthodes compress et flush) pour compression = None, "gzip" ou "zstd"."""
+    if compression is None:
+        return _NoCompression()
+    if compression == "gzip":
+        return zlib.compressobj(wbits=31)  # wbits=31 : format gzip
+    if compression == "zstd":
+        import zstandard  # dépendance optionnelle, nécessaire uniquement pour la compression zstd
+        return zstandard.ZstdCompressor().compressobj()
+    raise ValueError(f"Unsupported compression: {compression}")
+
+def write_csv_on_s3(df, save_path, bucket_name='fub-s3', csv_sep=";", quotechar='"', compression=None, chunksize=50000,
+                    part_size=16 * 1024**2, max_parts_in_flight=2):
+    """Ecrit df au format CSV sur le S3, sans jamais construire le fichier complet en mémoire.
+    Le tableau est converti en CSV par blocs de chunksize lignes. Les octets produits sont accumulés jusqu'à atteindre part_size
+    puis envoyés comme une partie d'un upload multipart. L'envoi d'une partie se fait dans un thread séparé pendant que la
+    conversion des lignes suivantes se poursuit. Au plus max_parts_in_flight parties sont en cours d'envoi simultanément,
+    ce qui borne la mémoire utilisée. Si le fichier fait moins de part_size octets, un simple put_object est utilisé.
+    En cas d'erreur, l'upload multipart est annulé (aucun fichier partiel n'est laissé sur le S3).
+    ENTREES :
+        - compression (str) : None, "gzip" ou "zstd". Il est conseillé d'utiliser une clé se terminant par .csv.gz ou
+            .csv.zst pour que le fichier puisse être relu avec preview_file
+        - part_size (int) : taille des parties en octets (le S3 impose au moins 5 Mo, sauf pour la dernière partie)"""
+    s3 = get_s3_client()
+    compressor = get_compressor(compression)
+    buffer = bytearray()
+    upload_id = None
+    pending_parts = []  # envois de parties en cours (futures), dans l'ordre des numéros de partie
+    uploaded_parts = []
+
+    def upload_part(body, part_number):
+        response = s3.upload_part(Bucket=bucket_name, Key=save_path, UploadId=upload_id, PartNumber=part_number, Body=body)
+        return {"PartNumber": part_number, "ETag": response["ETag"]}
+
+    with ThreadPoolExecutor(max_workers=max_parts_in_flight) as executor:
+        try:
+            for start in range(0, max(len(df), 1), chunksize):
+                csv_chunk = df.iloc[start:start + chunksize].to_csv(index=False, header=(start == 0), sep=csv_sep,
+                                                                     quotechar=quotechar)
+                buffer += compressor.compress(csv_chunk.encode("utf-8"))
+                if len(buffer) >= part_size:
+                    if upload_id is None:
+                        upload_id = s3.create_multipart_upload(Bucket=bucket_name, Key=save_path)["UploadId"]
+                    if len(pending_parts) >= max_parts_in_flight:
+                        uploaded_parts.append(pending_parts.pop(0).result())  # attend la fin de l'envoi le plus ancien
+                    pending_parts.append(executor.submit(upload_part, bytes(buffer), len(uploaded_parts) + len(pending_parts) + 1))
+                    buffer = bytearray()
+            buffer += compressor.flush()
+            if upload_id is None:
+                s3.put_object(Bucket=bucket_name, Key=save_path, Body=bytes(buffer))
+            else:
+                if len(buffer) > 0:
+                    pending_parts.append(executor.submit(upload_part, bytes(buffer), len(uploaded_parts) + len(pending_parts) + 1))
+                uploaded_parts += [future.result() for future in pending_parts]
+                s3.complete_multipart_upload(Bucket=bucket_name, Key=save_path, UploadId=upload_id,
+                                             MultipartUpload={"Parts": uploaded_parts})
+        except BaseException:
+            if upload_id is not None:
+                s3.abort_multipart_upload(Bucket=bucket_name, Key=save_path, UploadId=upload_id)
+            raise
     print(f"File saved on s3 at location {save_path}")
 
-#function to list objects in bucket
-def list_objects(bucket_name='fub-s3'):
-    """List up to 1000 objects in a bucket."""
-    print(f"Listing objects in bucket '{bucket_name}':")
+def read_many(keys, max_workers=None, **read_options):
+    """Lit plusieurs fichiers du S3 en parallèle (un thread par fichier, au plus max_workers simultanément).
+    read_options sont transmis à preview_file (ex : csv_sep=",", columns=[...]).
+    SORTIE :
+        dfs (dict) : dictionnaire associant chaque clé au pd.DataFrame lu"""
+    keys = list(dict.fromkeys(keys))
+    with ThreadPoolExecutor(max_workers=max_workers or max_transfer_workers) as executor:
+        dfs = executor.map(lambda key: preview_file(key, **read_options), keys)
+        return dict(zip(keys, dfs, strict=True))
+
+def serialize_table(df, key, csv_sep=";", quotechar='"'):
+    """Convertit df en octets, au format Parquet si key se termine par .parquet, au format CSV sinon.
+    Pour le format Parquet, les colonnes de type object contenant des valeurs de types mixtes (ex : codes de département lus
+    tantôt comme entiers, tantôt comme chaînes de caractères) sont converties en chaînes de caractères, comme dans un CSV."""
+    if key.endswith(".parquet"):
+        mixed = [column for column in df.columns
+                 if df[column].dtype == object and pd.api.types.infer_dtype(df[column], skipna=True).startswith("mixed")]
+        if mixed:
+            df = df.assign(**{column: df[column].where(df[column].isna(), df[column].astype(str)) for column in mixed})
+        buffer = io.BytesIO()
+        df.to_parquet(buffer, index=False)
+        return buffer.getvalue()
+    return df.to_csv(index=False, sep=csv_sep, quotechar=quotechar).encode("utf-8")
+
+def write_many(tables, bucket_name='fub-s3', csv_sep=";", quotechar='"', max_workers=None, skip_unchanged=True,
+               local_fold=None):
+    """Ecrit plusieurs tableaux sur le S3 en parallèle, au format Parquet pour les clés se terminant par .parquet et au format
+    CSV sinon.
+    Chaque tableau n'est converti qu'une seule fois par format, même s'il doit être écrit à plusieurs emplacements : il est envoyé
+    à la première clé, puis copié directement sur le S3 (sans nouveau transfert) vers les autres clés.
+    Le hash sha256 du contenu est stocké dans les métadonnées de l'objet : si skip_unchanged vaut True et qu'un objet de
+    contenu identique existe déjà à l'emplacement visé, il n'est pas réécrit.
+    Pour de très gros tableaux, préférer write_csv_on_s3, qui n'a jamais le fichier complet en mémoire.
+    ENTREES :
+        - tables (dict) : dictionnaire associant chaque clé de sauvegarde au pd.DataFrame à y écrire
+        - local_fold (str, optionnel) : si spécifié, les mêmes octets sont aussi écrits en local dans ce dossier (un fichier par
+            tableau et par format, nommé comme la dernière partie de sa première clé)
+    SORTIE :
+        written_keys (list de str) : clés effectivement écrites (hors fichiers inchangés)"""
+    s3 = get_s3_client()
+    groups = {}  # (id du tableau, format) -> (tableau, clés de sauvegarde associées)
+    for save_path, df in tables.items():
+        groups.setdefault((id(df), save_path.endswith(".parquet")), (df, []))[1].append(save_path)
 
-    response = s3.list_objects_v2(Bucket=bucket_name)
+    def get_remote_sha256(save_path):
+        try:
+            return s3.head_object(Bucket=bucket_name, Key=save_path)["Metadata"].get("sha256")
+        except ClientError as e:
+            if e.response["Error"]["Code"] not in ("404", "NoSuchKey"):
+                raise
+            return None
 
-    contents = response.get("Contents", [])
-    if not contents:
-        print("Bucket is empty.")
+    def write_group(df, save_paths):
+        body = serialize_table(df, save_paths[0], csv_sep=csv_sep, quotechar=quotechar)
+        digest = hashlib.sha256(body).hexdigest()
+        if local_fold is not None:
+            make_dir(local_fold)
+            with open(os.path.join(local_fold, os.path.basename(save_paths[0])), "wb") as f:
+                f.write(body)
+        if skip_unchanged:
+            unchanged = [save_path for save_path in save_paths if get_remote_sha256(save_path) == digest]
+            for save_path in unchanged:
+                print(f"File unchanged on s3 at location {save_path}")
+            save_paths = [save_path for save_path in save_paths if save_path not in unchanged]
+        if save_paths:
+            s3.put_object(Bucket=bucket_name, Key=save_paths[0], Body=body, Metadata={"sha256": digest})
+            for save_path in save_paths[1:]:
+                s3.copy_object(Bucket=bucket_name, Key=save_path, CopySource={"Bucket": bucket_name, "Key": save_paths[0]})
+            for save_path in save_paths:
+                print(f"File saved on s3 at location {save_path}")
+        return save_paths
+
+    with ThreadPoolExecutor(max_workers=max_workers or max_transfer_workers) as executor:
+        written_keys = executor.map(lambda group: write_group(*group), groups.values())
+        return [save_path for save_paths in written_keys for save_path in save_paths]
+
+def iter_object_summaries(bucket_name='fub-s3', prefix=""):
+    """Parcourt (avec pagination, donc sans limite de nombre) les objets du bucket dont la clé commence par prefix.
+    SORTIE :
+        générateur de dictionnaires contenant (entre autres) les attributs "Key", "Size", "ETag" et "LastModified" """
+    paginator = get_s3_client().get_paginator("list_objects_v2")
+    for page in paginator.paginate(Bucket=bucket_name, Prefix=prefix):
+        yield from page.get("Contents", [])
+
+#function to list objects in bucket
+def list_objects(bucket_name='fub-s3', prefix="", verbose=True):
+    """List all objects in a bucket (optionally only those whose key starts with prefix)."""
+    if verbose:
+        print(f"Listing objects in bucket '{bucket_name}':")
+
+    keys = [obj["Key"] for obj in iter_object_summaries(bucket_name, prefix)]
+    if not keys:
+        if verbose:
+            print("Bucket is empty.")
         return []
 
-    for obj in contents:
-        print(f" - {obj['Key']}")
+    if verbose:
+        for key in keys:
+            print(f" - {key}")
 
-    return [obj["Key"] for obj in contents]
+    return keys
 
 def make_dir(path):
-    if not os.path.exists(path):
-        os.makedirs(path)
-
+    os.makedirs(path, exist_ok=True)  # exist_ok : le dossier peut être créé en parallèle par un autre processus
 
 
-a = list_objects('fub-s3')
 if __name__ == '__main__':
+    #list_objects('fub-s3')
     #df = pd.read_csv("220128_BV_Communes_catégories.csv")
     #df = preview_file(key="data/converted/2021/brut/reponses-2021-12-01-08-00-00.csv", nrows=None)
     #print('df', df.shape)
     dest_path = "data/converted/2025/brut/220128_BV_Communes_catégories.csv"
     file_path = "220128_BV_Communes_catégories.csv"
-    #response = s3.upload_file(file_path, 'fub-s3', dest_path)
+    #response = get_s3_client().upload_file(file_path, 'fub-s3', dest_path)
+    #convert_to_parquet(key="data/converted/2025/brut/250604_Export_Reponses_Brut_Final_Result 1.csv", csv_sep=",", schema="2025")
 
@@ -0,0 +1,93 @@
+import os
+import time
+import sqlite3
+from contextlib import closing
+import pandas as pd
+import cache_s3
+from lecture_ecriture_donnees import iter_object_summaries
+
+"""Manifeste local des objets du bucket S3 (clé, taille, ETag, date de dernière modification), stocké dans une petite base
+SQLite à côté du cache local (voir cache_s3.py).
+
+Le manifeste permet de retrouver le dernier export d'une édition, ou de savoir si un fichier d'entrée a changé depuis la
+dernière exécution, sans relister le bucket à chaque fois. Il est mis à jour préfixe par préfixe avec refresh_manifest : seules
+les entrées nouvelles, modifiées ou supprimées sont écrites, et un préfixe rafraîchi depuis moins de max_age secondes n'est
+pas relisté.
+ex :
+    refresh_manifest("data/converted/2025/brut/", max_age=3600)
+    key = find_latest("data/converted/2025/brut/", suffix=".csv")"""
+
+manifest_path = os.path.join(cache_s3.cache_dir, "manifest.sqlite")
+
+
+def connect(path=None):
+    """Ouvre (et crée si besoin) la base SQLite du manifeste."""
+    path = manifest_path if path is None else path
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    connection = sqlite3.connect(path)
+    connection.execute("""CREATE TABLE IF NOT EXISTS objects (
+                            bucket TEXT, key TEXT, size INTEGER, etag TEXT, last_modified TEXT,
+                            PRIMARY KEY (bucket, key))""")
+    connection.execute("""CREATE TABLE IF NOT EXISTS listings (
+                            bucket TEXT, prefix TEXT, refreshed_at REAL,
+                            PRIMARY KEY (bucket, prefix))""")
+    return connection
+
+
+def refresh_manifest(prefix="", bucket_name='fub-s3', max_age=0, path=None):
+    """Met à jour le manifeste pour les objets dont la clé commence par prefix.
+    ENTREES :
+        - prefix (str) : préfixe des clés à lister
+        - max_age (float) : si prefix (ou un préfixe plus large) a été rafraîchi il y a moins de max_age secondes,
+            le bucket n'est pas relisté
+    SORTIES :
+        - changed_keys (list de str) : clés ajoutées, modifiées ou supprimées depuis le dernier rafraîchissement"""
+    # closing : le gestionnaire de contexte de sqlite3 valide (ou annule) la transaction mais ne ferme pas la connexion
+    with closing(connect(path)) as connection, connection:
+        last_refresh = connection.execute(
+            "SELECT MAX(refreshed_at) FROM listings WHERE bucket = ? AND substr(?, 1, length(prefix)) = prefix",
+            (bucket_name, prefix)).fetchone()[0]
+        if last_refresh is not None and time.time() - last_refresh < max_age:
+            return []
+        known = {key: etag for key, etag in connection.execute(
+            "SELECT key, etag FROM objects WHERE bucket = ? AND substr(key, 1, length(?)) = ?",
+            (bucket_name, prefix, prefix))}
+        changed_rows = []
+        for obj in iter_object_summaries(bucket_name, prefix):
+            etag = obj["ETag"].strip('"')
+            if known.pop(obj["Key"], None) != etag:
+                changed_rows.append((bucket_name, obj["Key"], obj["Size"], etag, obj["LastModified"].isoformat()))
+        connection.executemany("INSERT OR REPLACE INTO objects VALUES (?, ?, ?, ?, ?)", changed_rows)
+        # les clés connues qui n'ont pas été listées ont été supprimées du bucket
+        connection.executemany("DELETE FROM objects WHERE bucket = ? AND key = ?", [(bucket_name, key) for key in known])
+        connection.execute("INSERT OR REPLACE INTO listings VALUES (?, ?, ?)", (bucket_name, prefix, time.time()))
+    return [row[1] for row in changed_rows] + list(known)
+
+
+def get_manifest(prefix="", bucket_name='fub-s3', path=None):
+    """Renvoie les entrées du manifeste dont la clé commence par prefix, sous forme de pd.DataFrame
+    (colonnes "key", "size", "etag", "last_modified")."""
+    with closing(connect(path)) as connection:
+        manifest = pd.read_sql_query(
+            "SELECT key, size, etag, last_modified FROM objects WHERE bucket = ? AND substr(key, 1, length(?)) = ? ORDER BY key",
+            connection, params=(bucket_name, prefix, prefix))
+    manifest["last_modified"] = pd.to_datetime(manifest["last_modified"], utc=True)
+    return manifest
+
+
+def find_latest(prefix, bucket_name='fub-s3', suffix="", path=None):
+    """Renvoie la clé de l'objet le plus récemment modifié parmi ceux dont la clé commence par prefix et se termine par suffix
+    (None si aucun objet ne correspond). ex : find_latest("data/converted/2025/brut/", suffix=".csv")"""
+    manifest = get_manifest(prefix, bucket_name, path)
+    manifest = manifest[manifest["key"].str.endswith(suffix)]
+    if len(manifest) == 0:
+        return None
+    return manifest.loc[manifest["last_modified"].idxmax(), "key"]
+
+
+def get_etag(key, bucket_name='fub-s3', path=None):
+    """Renvoie l'ETag d'un objet d'après le manifeste (None si l'objet n'y figure pas). Permet de détecter qu'un fichier
+    d'entrée n'a pas changé depuis une exécution précédente sans interroger le S3."""
+    with closing(connect(path)) as connection:
+        row = connection.execute("SELECT etag FROM objects WHERE bucket = ? AND key = ?", (bucket_name, key)).fetchone()
+    return None if row is None else row[0]
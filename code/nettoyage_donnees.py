@@ -1,10 +1,51 @@
 from local_paths import your_local_save_fold
 import numpy as np
-import matplotlib.pyplot as plt
 import pandas as pd
+import os
+import hashlib
+from concurrent.futures import ProcessPoolExecutor
 from scipy.stats import norm, binom
+from scipy.sparse import coo_matrix
+from scipy.sparse.csgraph import connected_components
 from lecture_ecriture_donnees import preview_file, write_csv_on_s3, make_dir
-from utils import get_commune_name_from_insee
+from utils import CommuneRegistry
+from audit_nettoyage import AuditStore
+from rendu_histogrammes import render_histograms
+
+
+# probabilité qu'un echantillon aléatoire d'une distribution gaussienne soit inférieur à mu - 2*std
+p_lower_tail = norm.cdf(-2)
+
+
+class BinomialThresholds:
+    """Table (mémoïsée) des seuils du test binomial de la méthodologie 2025 : pour une probabilité p et un risque alpha, le
+    seuil k(N) tel que P(Y>k) = alpha avec Y ~ B(N, p) ne dépend que du nombre d'échantillons N. Pour chaque couple (alpha, p),
+    les seuils de N = 0 à max_n sont calculés en une seule fois (binom.ppf vectorisé), puis réutilisés pour toutes les communes
+    et tous les jeux de paramètres. La table est agrandie (en doublant sa taille) si un N plus grand est demandé.
+    La même table peut servir à d'autres tests binomiaux, pour une probabilité p fixée."""
+
+    def __init__(self, max_n=1024):
+        self.max_n = max_n
+        self.tables = {}
+
+    def table(self, alpha, p=p_lower_tail, max_n=None):
+        """Renvoie le tableau des seuils k(N) pour N = 0 .. max_n (au moins)"""
+        max_n = self.max_n if max_n is None else max_n
+        table = self.tables.get((alpha, p))
+        if table is None or len(table) <= max_n:
+            size = max(max_n, 2*(len(table) - 1) if table is not None else 0)
+            table = binom.ppf(1 - alpha, np.arange(size + 1), p).astype(int)
+            self.tables[(alpha, p)] = table
+        return table
+
+    def __call__(self, n, alpha, p=p_lower_tail):
+        """Seuil(s) k associé(s) à un nombre (ou un tableau de nombres) d'échantillons n"""
+        n = np.asarray(n, dtype=int)
+        table = self.table(alpha, p, int(n.max()) if n.size > 0 else 0)
+        return table[n] if n.ndim > 0 else int(table[n])
+
+
+binomial_thresholds = BinomialThresholds()  # table partagée par l'ensemble des tests
 
 
 def filter_one_commune_2025_method(df_commune, commune_name, communes_to_filter=[], communes_not_to_filter=[],
@@ -47,40 +88,45 @@ def filter_one_commune_2025_method(df_commune, commune_name, communes_to_filter=
     """
     adjusted_mean, adjusted_std = compute_adjusted_mean_std(df_commune[avg_note_att_name], commune_name)
 
-    upper_queue = df_commune[df_commune[avg_note_att_name] >= adjusted_mean + 2*adjusted_std]
-    lower_queue = df_commune[df_commune[avg_note_att_name] <= adjusted_mean - 2*adjusted_std]
-    central_values = df_commune[(df_commune[avg_note_att_name] >= adjusted_mean - 2*adjusted_std)
-                                & (df_commune[avg_note_att_name] <= adjusted_mean + 2*adjusted_std)]
+    # un seul tri des notes : les queues et la partie centrale de la distribution sont des intervalles d'indices du tableau trié
+    values = df_commune[avg_note_att_name].to_numpy(dtype="float64")
+    order = np.argsort(values, kind="stable")
+    sorted_values = values[order]
+    n_valid = len(values) - np.isnan(values).sum()  # les notes manquantes sont à la fin du tableau trié et ne sont jamais conservées
+    sorted_values = sorted_values[:n_valid]
+    upper_limit, lower_limit = adjusted_mean + 2*adjusted_std, adjusted_mean - 2*adjusted_std
+    # une limite non finie (moyenne ajustée NaN si toutes les notes sont inférieures à 1.5 ou supérieures à 5.5) donne des
+    # queues vides, comme une comparaison avec NaN
+    upper_start = np.searchsorted(sorted_values, upper_limit, "left") if np.isfinite(upper_limit) else n_valid  # queue supérieure : [upper_start, n_valid[
+    lower_stop = np.searchsorted(sorted_values, lower_limit, "right") if np.isfinite(lower_limit) else 0  # queue inférieure : [0, lower_stop[
+    n_upper, n_lower = n_valid - upper_start, lower_stop
 
     N_sample = len(df_commune)
-    p = norm.cdf(-2)  # probabilité qu'un echantillon aléatoire d'une distribution gaussienne soit inférieur à mu - 2*std
-    k = int(binom.ppf(1 - alpha, N_sample, p)) # k est tel que P(Y>k) = alpha avec Y ~ B(N_sample, p)
+    # p = norm.cdf(-2) : probabilité qu'un echantillon aléatoire d'une distribution gaussienne soit inférieur à mu - 2*std
+    k = binomial_thresholds(N_sample, alpha) # k est tel que P(Y>k) = alpha avec Y ~ B(N_sample, p)
+    kept = None  # intervalle d'indices (du tableau trié) des réponses conservées, None si toutes les réponses sont conservées
     if commune_name in communes_not_to_filter:
-        filtered_data = df_commune.copy()
         filter = False
-    elif (len(upper_queue) >= beta*k and len(lower_queue) >= beta*k) or commune_name in communes_to_filter:
-        filtered_data = central_values.copy()
+    elif (n_upper >= beta*k and n_lower >= beta*k) or commune_name in communes_to_filter:
+        # valeurs centrales : adjusted_mean - 2*adjusted_std <= note <= adjusted_mean + 2*adjusted_std
+        kept = (np.searchsorted(sorted_values, lower_limit, "left"), np.searchsorted(sorted_values, upper_limit, "right"))
         filter = True
-    elif len(upper_queue) >= beta*k and len(lower_queue) <= beta*k:
-        nb_elt_to_supress = len(upper_queue) - len(lower_queue)
-        limit_val = df_commune[avg_note_att_name].nlargest(nb_elt_to_supress).iloc[-1]
-        filtered_data = df_commune[df_commune[avg_note_att_name]<limit_val].copy()
+    elif n_upper >= beta*k and n_lower <= beta*k:
+        nb_elt_to_supress = n_upper - n_lower
+        limit_val = sorted_values[n_valid - nb_elt_to_supress]  # nb_elt_to_supress-ième plus grande note
+        kept = (0, np.searchsorted(sorted_values, limit_val, "left"))  # notes < limit_val
         filter = True
-    elif len(upper_queue) <= beta*k and len(lower_queue) >= beta *k:
-        #print('len lower', len(lower_queue))
-        #print('len upper', len(upper_queue))
-
-        nb_elt_to_suppress = len(lower_queue) - len(upper_queue)
-        #print('nb elt to suppress', nb_elt_to_suppress)
-        #print('n smallest', df_commune[avg_note_att_name].nsmallest(nb_elt_to_suppress))
-        limit_val = df_commune[avg_note_att_name].nsmallest(nb_elt_to_suppress).iloc[-1]
-
-        filtered_data = df_commune[df_commune[avg_note_att_name]>limit_val].copy()
+    elif n_upper <= beta*k and n_lower >= beta *k:
+        nb_elt_to_suppress = n_lower - n_upper
+        limit_val = sorted_values[nb_elt_to_suppress - 1]  # nb_elt_to_suppress-ième plus petite note
+        kept = (np.searchsorted(sorted_values, limit_val, "right"), n_valid)  # notes > limit_val
         filter = True
     else: #len(upper_queue) <= 2*k and len(lower_queue) <= 2 *k:
-        filtered_data = df_commune.copy()
         filter = False
-    largest_queue = upper_queue if len(upper_queue) > len(lower_queue) else lower_queue
+    # une seule sélection de lignes (dans l'ordre d'origine du tableau)
+    filtered_data = df_commune.copy() if kept is None else df_commune.iloc[np.sort(order[kept[0]:kept[1]])].copy()
+    largest_queue = df_commune.iloc[np.sort(order[upper_start:n_valid])] if n_upper > n_lower \
+        else df_commune.iloc[np.sort(order[:lower_stop])]
     return filtered_data, filter, adjusted_mean, adjusted_std, largest_queue
 
 """
@@ -104,6 +150,68 @@ def filter_one_commune_ip(df_commune, ip_id, commentaire_id, email_id, avg_note_
     return df_commune, df_ip_doublon_view, fraudulous_ip, filter
 
 
+def analyse_ip(df, commune_id, ip_id, commentaire_id, email_id, avg_note_att_name="average_note", x=2, y=5):
+    """Analyse des adresses ip identiques sur l'ensemble du jeu de données, en une seule passe (au lieu d'une analyse
+    commune par commune). Les adresses ip sont hachées (entiers de 64 bits), puis les réponses sont regroupées par adresse ip et
+    par couple (commune, adresse ip) pour calculer les nombres de réponses et les notes moyennes.
+    Une adresse ip est frauduleuse pour une commune (au sens de filter_one_commune_ip) si elle apparait au moins max(x, y) fois
+    dans la commune avec une note moyenne supérieure à 5 ou inférieure à 2.
+    Les communes qui partagent des adresses ip répétées (au moins x réponses dans chacune des communes) sont regroupées
+    (composantes connexes du graphe communes - adresses ip) : chaque groupe de plusieurs communes peut signaler une même source
+    de contributions répartie sur des communes voisines.
+    ENTREES :
+        - df (pd.DataFrame) : réponses, avec la colonne avg_note_att_name
+        - commune_id, ip_id, commentaire_id, email_id (str) : colonnes associées à la commune, à l'adresse ip, aux
+            commentaires et à l'adresse email
+        - x, y (int) : paramètres de filter_one_commune_ip
+    SORTIE :
+        ip_table (pd.DataFrame) : une ligne par couple (commune, adresse ip) avec au moins x réponses, avec le nombre de réponses
+            et la note moyenne dans la commune, l'indicateur "ip frauduleuse", le nombre de communes, le nombre de réponses
+            et la note moyenne de l'adresse ip sur l'ensemble du jeu de données, et le numéro du groupe de communes
+            ("Groupe multi-communes", -1 si l'adresse ip n'est répétée que dans une seule commune)
+    """
+    df = df[df[commune_id].notna() & df[ip_id].notna()]
+    ip_hash = pd.util.hash_pandas_object(df[ip_id], index=False).to_numpy()
+    notes = df[avg_note_att_name].to_numpy(dtype="float64")
+    communes = df[commune_id].astype(object).to_numpy()
+
+    by_ip = pd.DataFrame({"hash": ip_hash, "commune": communes, "note": notes}).groupby("hash", sort=False)
+    ip_stats = pd.DataFrame({"Nombre de communes (ip)": by_ip["commune"].nunique(),
+                             "Nombre de réponses (ip)": by_ip.size(),
+                             "Note moyenne (ip)": by_ip["note"].mean()})
+    by_pair = pd.DataFrame({"commune": communes, "hash": ip_hash, "ip": df[ip_id].to_numpy(), "note": notes}) \
+        .groupby(["commune", "hash"], sort=False)
+    ip_table = by_pair.agg(ip=("ip", "first"), n=("note", "size"), mean=("note", "mean"))
+    ip_table = ip_table[ip_table["n"] >= x].reset_index()
+    ip_table.columns = [commune_id, "hash ip", ip_id, "Nombre de réponses", "Note moyenne"]
+    candidates = ip_table["Nombre de réponses"] >= y
+    ip_table["ip frauduleuse"] = candidates & ((ip_table["Note moyenne"] >= 5) | (ip_table["Note moyenne"] <= 2))
+    # la moyenne par groupe n'est pas calculée dans le même ordre que dans filter_one_commune_ip : pour les rares moyennes
+    # situées à un arrondi près des seuils, la décision est recalculée avec filter_one_commune_ip
+    borderline = candidates & ((np.abs(ip_table["Note moyenne"] - 5) < 1e-9) | (np.abs(ip_table["Note moyenne"] - 2) < 1e-9))
+    for commune in ip_table.loc[borderline, commune_id].unique():
+        _, _, fraudulous_ip, _ = filter_one_commune_ip(df[communes == commune], ip_id, commentaire_id, email_id,
+                                                       avg_note_att_name, x, y)
+        in_commune = (ip_table[commune_id] == commune).to_numpy()
+        ip_table.loc[in_commune, "ip frauduleuse"] = ip_table.loc[in_commune, ip_id].isin(fraudulous_ip)
+    ip_table = ip_table.join(ip_stats, on="hash ip")
+
+    # groupes de communes reliées par des adresses ip répétées dans plusieurs communes
+    shared_ip = (ip_table.groupby("hash ip")[commune_id].transform("size") >= 2).to_numpy()
+    commune_codes, commune_index = np.unique(ip_table.loc[shared_ip, commune_id].astype(str), return_inverse=True)
+    ip_codes, ip_index = np.unique(ip_table.loc[shared_ip, "hash ip"], return_inverse=True)
+    graph = coo_matrix((np.ones(len(commune_index)), (commune_index, len(commune_codes) + ip_index)),
+                       shape=(len(commune_codes) + len(ip_codes),) * 2)
+    _, labels = connected_components(graph, directed=False)
+    groups = np.full(len(ip_table), -1)
+    groups[shared_ip] = pd.factorize(labels[commune_index])[0]
+    ip_table["Groupe multi-communes"] = groups
+    # les groupes de plusieurs communes en premier
+    order = np.lexsort((-ip_table["Nombre de réponses"].to_numpy(), ip_table[commune_id].astype(str).to_numpy(),
+                        np.where(groups < 0, len(ip_table), groups)))
+    return ip_table.iloc[order].reset_index(drop=True)
+
+
 def filter_one_commune_2019_method(df_commune, questions_to_average, email_id, avg_note_att_name="average_note"):
     """recodage de la methodo de 2019 (pas utilisée ici)"""
     # moyennage de l'ensemble des critères d'évaluation
@@ -126,12 +234,340 @@ def filter_one_commune_2019_method(df_commune, questions_to_average, email_id, a
     print('Nombre de réponses après filtrage', len(filtered))
     return filtered
 
+def clean_all_communes(df, insee_codes, commune_id, ip_id, commentaire_id, email_id, registry, communes_to_filter=(),
+                       communes_not_to_filter=(), nb_contribution_min=(30, 50), avg_note_att_name="average_note",
+                       alpha=8*10**-4, beta=2, x=2, y=5):
+    """Applique en une seule passe, à l'ensemble des communes, la méthodologie de filter_one_commune_ip suivie de celle de
+    filter_one_commune_2025_method (voir ces fonctions pour le détail de la méthodologie), avec des résultats identiques.
+    Au lieu d'extraire les réponses de chaque commune par un parcours complet du tableau, les réponses sont triées une seule
+    fois par commune. Les comptages (nombre de contributions, adresses ip identiques, queues de distribution), les seuils
+    binomiaux et les décisions de filtrage sont calculés pour toutes les communes à la fois. Seules la moyenne et l'écart-type
+    ajustés sont calculés commune par commune (sur des tranches du tableau trié), avec compute_adjusted_mean_std, pour
+    garantir exactement les mêmes arrondis que la méthode commune par commune.
+    ENTREES :
+        - df (pd.DataFrame) : réponses sans note manquante, avec la colonne avg_note_att_name (note moyenne de chaque réponse)
+        - insee_codes (array) : codes insee des communes, dans l'ordre dans lequel les communes doivent être traitées
+        - registry (CommuneRegistry) : tableau des communes indexé (voir utils.py)
+        - les autres arguments sont ceux de filter_data_set, filter_one_commune_ip et filter_one_commune_2025_method
+    SORTIES :
+        - communes (pd.DataFrame) : une ligne par commune de insee_codes (dans le même ordre), avec le nom, la population,
+            les nombres de contributions, les décisions de filtrage et les statistiques ajustées de chaque commune
+        - rows (pd.DataFrame) : une ligne par réponse de df (même index), avec le numéro de la commune associée (position
+            dans insee_codes, -1 si la commune est manquante) et des indicateurs par réponse (supprimée par le filtrage ip,
+            dans la queue supérieure ou inférieure, dans la plus grande des deux queues, conservée après nettoyage)
+    """
+    n_communes = len(insee_codes)
+    communes_info = registry.lookup_many(insee_codes, verbose=True)
+    noms_communes, populations = communes_info["Commune"].to_numpy(dtype=object), communes_info["Population"].to_numpy()
+    values = df[avg_note_att_name].to_numpy(dtype="float64")
+    group = pd.Index(np.asarray(insee_codes, dtype=object)).get_indexer(df[commune_id])
+    group[df[commune_id].isna().to_numpy()] = -1  # comme dans la version commune par commune, une commune manquante n'est jamais traitée
+    nb_contributions = np.bincount(group[group >= 0], minlength=n_communes)
+    n_min = np.where(populations <= 5000, nb_contribution_min[0], nb_contribution_min[1])
+    eligible = nb_contributions >= n_min
+    row_eligible = (group >= 0) & eligible[np.maximum(group, 0)]
+    # tri (stable) des réponses par commune : les réponses de chaque commune forment une tranche contiguë de order, dans
+    # l'ordre du tableau d'origine
+    order = np.flatnonzero(row_eligible)
+    order = order[np.argsort(group[order], kind="stable")]
+
+    def commune_slices(mask):
+        """positions (dans df) des réponses vérifiant mask, regroupées par commune, et début de la tranche de chaque commune"""
+        positions = order[mask[order]]
+        starts = np.concatenate([[0], np.cumsum(np.bincount(group[positions], minlength=n_communes))])
+        return positions, starts
+
+    # 1) filtrage ip : nombre de réponses et note moyenne de chaque couple (commune, ip)
+    ip_fraud = np.zeros(len(df), dtype=bool)
+    with_ip = row_eligible & df[ip_id].notna().to_numpy()
+    ip_groups = pd.DataFrame({"commune": group[with_ip], "ip": df[ip_id].to_numpy()[with_ip],
+                              "note": values[with_ip]}).groupby(["commune", "ip"], sort=False)["note"]
+    ip_counts, ip_means = ip_groups.transform("size").to_numpy(), ip_groups.transform("mean").to_numpy()
+    candidates = (ip_counts >= x) & (ip_counts >= y)
+    ip_fraud[with_ip] = candidates & ((ip_means >= 5) | (ip_means <= 2))
+    # la moyenne par groupe n'est pas calculée dans le même ordre que dans filter_one_commune_ip : pour les rares moyennes
+    # situées à un arrondi près des seuils, la décision est recalculée avec filter_one_commune_ip
+    borderline = candidates & ((np.abs(ip_means - 5) < 1e-9) | (np.abs(ip_means - 2) < 1e-9))
+    positions, starts = commune_slices(row_eligible)
+    for g in np.unique(group[with_ip][borderline]):
+        commune_positions = positions[starts[g]:starts[g+1]]
+        df_commune = df.iloc[commune_positions]
+        _, _, fraudulous_ip, _ = filter_one_commune_ip(df_commune, ip_id, commentaire_id, email_id, avg_note_att_name, x, y)
+        ip_fraud[commune_positions] = df_commune[ip_id].isin(fraudulous_ip).to_numpy()
+    filter_ip = np.bincount(group[ip_fraud], minlength=n_communes) > 0
+
+    # 2) filtrage de la distribution, sur les réponses restantes
+    remaining = row_eligible & ~ip_fraud
+    positions, starts = commune_slices(remaining)
+    adjusted_mean, adjusted_std = np.full(n_communes, np.nan), np.zeros(n_communes)
+    for g in np.flatnonzero(eligible):
+        adjusted_mean[g], adjusted_std[g] = compute_adjusted_mean_std(pd.Series(values[positions[starts[g]:starts[g+1]]]),
+                                                                      noms_communes[g])
+    row_group = np.maximum(group, 0)
+    upper_limit, lower_limit = (adjusted_mean + 2*adjusted_std)[row_group], (adjusted_mean - 2*adjusted_std)[row_group]
+    upper_queue = remaining & (values >= upper_limit)
+    lower_queue = remaining & (values <= lower_limit)
+    central_values = remaining & (values >= lower_limit) & (values <= upper_limit)
+    n_sample = np.diff(starts)
+    n_upper = np.bincount(group[upper_queue], minlength=n_communes)
+    n_lower = np.bincount(group[lower_queue], minlength=n_communes)
+    # p = norm.cdf(-2) : probabilité qu'un echantillon aléatoire d'une distribution gaussienne soit inférieur à mu - 2*std
+    k = binomial_thresholds(n_sample, alpha)  # k est tel que P(Y>k) = alpha avec Y ~ B(N_sample, p)
+    not_to_filter, to_filter = np.isin(noms_communes, communes_not_to_filter), np.isin(noms_communes, communes_to_filter)
+    # 0 : pas de filtrage, 1 : suppression des deux queues, 2 : suppression d'une partie de la queue supérieure,
+    # 3 : suppression d'une partie de la queue inférieure (mêmes cas, dans le même ordre, que filter_one_commune_2025_method)
+    case = np.select([not_to_filter,
+                      ((n_upper >= beta*k) & (n_lower >= beta*k)) | to_filter,
+                      (n_upper >= beta*k) & (n_lower <= beta*k),
+                      (n_upper <= beta*k) & (n_lower >= beta*k)],
+                     [0, 1, 2, 3], default=0)
+    # valeur limite des cas 2 et 3 : nb-ième plus grande (resp. plus petite) note moyenne de la commune, lue dans les notes
+    # restantes triées par commune puis par note (un seul tri, chaque commune reste la tranche [starts[g], starts[g+1][)
+    sorted_values = values[positions][np.lexsort((values[positions], group[positions]))]
+    limit_index = np.where(case == 2, starts[1:] - (n_upper - n_lower), starts[:-1] + (n_lower - n_upper) - 1)
+    limit_val = np.where(np.isin(case, [2, 3]), sorted_values[np.clip(limit_index, 0, max(len(positions) - 1, 0))]
+                         if len(positions) > 0 else np.nan, np.nan)
+    row_case = case[row_group]
+    kept = remaining & ((row_case == 0)
+                        | ((row_case == 1) & central_values)
+                        | ((row_case == 2) & (values < limit_val[row_group]))
+                        | ((row_case == 3) & (values > limit_val[row_group])))
+    n_kept = np.bincount(group[kept], minlength=n_communes)
+    largest_queue = np.where((n_upper > n_lower)[row_group], upper_queue, lower_queue)
+
+    communes = pd.DataFrame({"insee": np.asarray(insee_codes, dtype=object),
+                             "Nom commune": noms_communes,
+                             "Population": populations,
+                             "Nombre minimal de contributions": n_min,
+                             "Nombre de contributions avant nettoyage": nb_contributions,
+                             "Commune évaluée": eligible,
+                             "filtrage ip": filter_ip & eligible,
+                             "Moyenne ajustée": adjusted_mean,
+                             "Ecart-type ajusté": adjusted_std,
+                             "Queue supérieure": n_upper,
+                             "Queue inférieure": n_lower,
+                             "Seuil binomial": k,
+                             "filtrage distribution": (case > 0) & eligible,
+                             "Nombre de contributions après nettoyage": n_kept,
+                             "Commune retenue": eligible & (n_kept >= n_min)})
+    rows = pd.DataFrame({"commune": group,
+                         "filtrage ip": ip_fraud,
+                         "queue supérieure": upper_queue,
+                         "queue inférieure": lower_queue,
+                         "plus grande queue": largest_queue,
+                         "conservée": kept}, index=df.index)
+    return communes, rows
+
+
+def get_commune_diagnostics(g, shared):
+    """Calcule les diagnostics d'une commune inspectée (voir filter_data_set) : sa ligne dans le tableau des communes
+    potentiellement frauduleuses et les données de ses histogrammes (notes moyennes avant et après filtrage, dates de réponse).
+    Les figures ne sont pas tracées ici mais par render_histograms (voir rendu_histogrammes.py), à partir de ces données.
+    Les autres diagnostics (commentaires, adresses ip identiques ...) sont regroupés dans les tables de diagnostics (voir save_audit)
+    ENTREES :
+        - g (int) : numéro de la commune (ligne du tableau communes renvoyé par clean_all_communes)
+        - shared (dict) : données communes à toutes les communes (voir filter_data_set)
+    SORTIES :
+        - row (list ou None) : ligne du tableau des communes potentiellement frauduleuses (None si la commune n'a pas été filtrée)
+        - identical_ip (bool) : vaut True ssi la commune a des contributions avec des adresses ip identiques
+        - histogram (dict ou None) : données des histogrammes de la commune (None si aucun histogramme n'est à sauvegarder) :
+            code insee, nom de la commune, dossiers de sauvegarde, bornes et effectifs des intervalles de notes moyennes avant
+            et après filtrage, moyenne et écart-type ajustés, début, pas (en heures) et effectifs des intervalles de temps
+            de l'ensemble des réponses et des réponses de la plus grande queue de distribution"""
+    df, rows, histo_save_fold = shared["df"], shared["rows"], shared["histo_save_fold"]
+    avg_note_att_name = shared["avg_note_att_name"]
+    commune = shared["communes"].iloc[g]
+    nom_commune, n_min = commune["Nom commune"], commune["Nombre minimal de contributions"]
+    filter_ip, filter_distr, filter = commune["filtrage ip"], commune["filtrage distribution"], shared["filtered_any"][g]
+    commune_positions = shared["order"][shared["starts"][g]:shared["starts"][g+1]]
+    df_commune = df.iloc[commune_positions]
+    rows_commune = rows.iloc[commune_positions]
+    kept = rows_commune["conservée"].to_numpy()
+    row = None
+    if filter:
+        n_kept = kept.sum()
+        row = [nom_commune, n_kept<n_min, len(df_commune)-n_kept, len(df_commune), n_kept, filter_ip, filter_distr]
+    save_folds = np.array([f'{histo_save_fold}/specified_communes', f'{histo_save_fold}/potential_fraud_detected'])
+    save_folds = [str(save_fold) for save_fold in save_folds[[nom_commune in shared["communes_to_save"], filter]]]
+    histogram = None
+    if len(save_folds) > 0:
+        values = df_commune[avg_note_att_name].to_numpy()
+        bins, counts_before = get_notes_histogram(values, 1, 6, 0.2)
+        _, counts_after = get_notes_histogram(values[kept], 1, 6, 0.2)
+        time_start, time_counts, time_counts_largest_queue = get_response_time_histogram(
+            df_commune, rows_commune["plus grande queue"].to_numpy(), x=12)
+        histogram = {"insee": commune["insee"], "nom_commune": nom_commune, "save_folds": save_folds,
+                     "fingerprint": shared["fingerprints"][g], "bins": bins, "counts_before": counts_before,
+                     "counts_after": counts_after, "adjusted_mean": commune["Moyenne ajustée"],
+                     "adjusted_std": commune["Ecart-type ajusté"], "time_start": time_start, "time_step": 12,
+                     "time_counts": time_counts, "time_counts_largest_queue": time_counts_largest_queue}
+    return row, bool(shared["with_identical_ip"][g]), histogram
+
+
+worker_shared = {}  # données partagées par toutes les tâches d'un processus (voir init_diagnostics_worker)
+
+
+def init_diagnostics_worker(shared):
+    """Initialisation d'un processus de calcul des diagnostics : les données sont reçues une seule fois par processus (avec la
+    méthode de démarrage "fork", utilisée par défaut sous Linux, elles sont même héritées du processus parent sans copie)."""
+    worker_shared.update(shared)
+
+
+def get_commune_diagnostics_in_worker(g):
+    return get_commune_diagnostics(g, worker_shared)
+
+
+def get_communes_fingerprints(df, communes, order, starts, communes_to_hash, params):
+    """Calcule l'empreinte de certaines communes : hash (sha256) des réponses de la commune (toutes les colonnes, dans l'ordre
+    du tableau), du nom de la commune, de son nombre minimal de contributions et des paramètres de nettoyage params.
+    Deux exécutions de filter_data_set avec la même empreinte pour une commune produisent les mêmes résultats pour cette commune.
+    SORTIE :
+        fingerprints (dict) : empreinte (str) de chaque commune de communes_to_hash"""
+    row_hashes = pd.util.hash_pandas_object(df, index=False).to_numpy()
+    params = repr([list(df.columns), params]).encode("utf-8")
+    fingerprints = {}
+    for g in communes_to_hash:
+        fingerprint = hashlib.sha256(row_hashes[order[starts[g]:starts[g+1]]].tobytes())
+        fingerprint.update(repr([communes["Nom commune"].iloc[g], communes["Nombre minimal de contributions"].iloc[g]]).encode("utf-8"))
+        fingerprint.update(params)
+        fingerprints[g] = fingerprint.hexdigest()
+    return fingerprints
+
+
+def sweep_parameters(df, insee_codes, commune_id, ip_id, commentaire_id, email_id, registry, alphas=(8*10**-4,), betas=(2,),
+                     nb_contributions_min=((30, 50),), xs=(2,), ys=(5,), communes_to_filter=(), communes_not_to_filter=(),
+                     avg_note_att_name="average_note"):
+    """Evalue la méthodologie de nettoyage (filter_one_commune_ip puis filter_one_commune_2025_method) pour toute une grille
+    de paramètres, sans relancer le nettoyage complet pour chaque jeu de paramètres.
+    Pour chaque couple (x, y) (paramètres du filtrage ip), le filtrage ip et les moyennes et écarts-types ajustés sont calculés
+    une seule fois (clean_all_communes), puis les notes moyennes restantes de chaque commune sont triées. Les tailles des queues
+    et les nombres de réponses conservées dans chacun des cas de filter_one_commune_2025_method sont alors obtenus par
+    recherche dichotomique (np.searchsorted) dans ces tableaux triés. Ils ne dépendent ni de alpha, ni de beta, ni de
+    nb_contribution_min : l'évaluation de chaque jeu de paramètres se réduit à quelques opérations vectorisées.
+    ENTREES :
+        - df, insee_codes, commune_id, ip_id, commentaire_id, email_id, registry : voir clean_all_communes
+        - alphas, betas, xs, ys (list ou tuple) : valeurs testées pour chacun des paramètres alpha, beta, x et y
+        - nb_contributions_min (list ou tuple de couples d'int) : valeurs testées pour le paramètre nb_contribution_min
+    SORTIE :
+        sweep (pd.DataFrame) : une ligne par jeu de paramètres, avec le nombre de communes évaluées, filtrées (filtrage ip,
+            filtrage de la distribution) et éliminées après nettoyage, et les nombres de contributions supprimées et conservées
+    """
+    results = []
+    for x in xs:
+        for y in ys:
+            communes, rows = clean_all_communes(df, insee_codes, commune_id, ip_id, commentaire_id, email_id, registry,
+                                                communes_to_filter, communes_not_to_filter, (1, 1), avg_note_att_name, x=x, y=y)
+            n_communes = len(communes)
+            group = rows["commune"].to_numpy()
+            remaining = (group >= 0) & ~rows["filtrage ip"].to_numpy()
+            values, group = df[avg_note_att_name].to_numpy(dtype="float64")[remaining], group[remaining]
+            order = np.lexsort((values, group))  # notes triées par commune
+            sorted_values = values[order]
+            starts = np.concatenate([[0], np.cumsum(np.bincount(group, minlength=n_communes))])
+            upper_limit = (communes["Moyenne ajustée"] + 2*communes["Ecart-type ajusté"]).to_numpy()
+            lower_limit = (communes["Moyenne ajustée"] - 2*communes["Ecart-type ajusté"]).to_numpy()
+            n_sample = np.diff(starts)
+            n_upper, n_lower, n_central = np.zeros(n_communes, dtype=int), np.zeros(n_communes, dtype=int), np.zeros(n_communes, dtype=int)
+            n_kept_upper, n_kept_lower = n_sample.copy(), n_sample.copy()
+            for g in range(n_communes):
+                values_g = sorted_values[starts[g]:starts[g+1]]
+                n = len(values_g)
+                # une limite non finie (moyenne ajustée NaN) donne des queues et une partie centrale vides, comme dans
+                # filter_one_commune_2025_method et clean_all_communes
+                upper_finite, lower_finite = np.isfinite(upper_limit[g]), np.isfinite(lower_limit[g])
+                upper_start = np.searchsorted(values_g, upper_limit[g], "left") if upper_finite else n
+                lower_stop = np.searchsorted(values_g, lower_limit[g], "right") if lower_finite else 0
+                n_upper[g], n_lower[g] = n - upper_start, lower_stop
+                if upper_finite and lower_finite:
+                    n_central[g] = np.searchsorted(values_g, upper_limit[g], "right") - np.searchsorted(values_g, lower_limit[g], "left")
+                nb = n_upper[g] - n_lower[g]
+                if nb > 0:  # suppression d'une partie de la queue supérieure : notes < nb-ième plus grande note
+                    n_kept_upper[g] = np.searchsorted(values_g, values_g[n - nb], "left")
+                elif nb < 0:  # suppression d'une partie de la queue inférieure : notes > nb-ième plus petite note
+                    n_kept_lower[g] = n - np.searchsorted(values_g, values_g[-nb - 1], "right")
+            n_before = communes["Nombre de contributions avant nettoyage"].to_numpy()
+            filter_ip = communes["filtrage ip"].to_numpy()
+            noms_communes = communes["Nom commune"].to_numpy()
+            not_to_filter, to_filter = np.isin(noms_communes, communes_not_to_filter), np.isin(noms_communes, communes_to_filter)
+            populations = communes["Population"].to_numpy()
+
+            for alpha in alphas:
+                k = binomial_thresholds(n_sample, alpha)
+                for beta in betas:
+                    case = np.select([not_to_filter,
+                                      ((n_upper >= beta*k) & (n_lower >= beta*k)) | to_filter,
+                                      (n_upper >= beta*k) & (n_lower <= beta*k),
+                                      (n_upper <= beta*k) & (n_lower >= beta*k)],
+                                     [0, 1, 2, 3], default=0)
+                    n_kept = np.choose(case, [n_sample, n_central, n_kept_upper, n_kept_lower])
+                    for nb_contribution_min in nb_contributions_min:
+                        n_min = np.where(populations <= 5000, nb_contribution_min[0], nb_contribution_min[1])
+                        eligible = n_before >= n_min
+                        filtered = eligible & (filter_ip | (case > 0))
+                        results.append([alpha, beta, nb_contribution_min[0], nb_contribution_min[1], x, y, eligible.sum(),
+                                        (eligible & filter_ip).sum(), (eligible & (case > 0)).sum(), filtered.sum(),
+                                        (filtered & (n_kept < n_min)).sum(), (n_before - n_kept)[eligible].sum(),
+                                        n_kept[eligible & (n_kept >= n_min)].sum()])
+    return pd.DataFrame(results, columns=["alpha", "beta", "nb_contribution_min (<= 5000 habitants)",
+                                          "nb_contribution_min (> 5000 habitants)", "x", "y", "Nombre de communes évaluées",
+                                          "Nombre de communes filtrage ip", "Nombre de communes filtrage distribution",
+                                          "Nombre de communes potentiellement frauduleuses",
+                                          "Nombre de communes éliminées après nettoyage",
+                                          "Nombre de contributions supprimées", "Nombre de contributions conservées"])
+
+
+def save_audit(audit_fold, df, communes, rows, ip_table, ip_communes, bursts, burst_communes, commune_id, ip_id, commentaire_id,
+               avg_note_att_name="average_note", batch_size=1000):
+    """Sauvegarde les diagnostics du nettoyage dans les tables Parquet de audit_fold (voir AuditStore), par lots de batch_size
+    communes (un groupe de lignes par lot et par table, une seule écriture de fichier par table) :
+        - communes : décisions de filtrage et statistiques ajustées de chaque commune (tableau renvoyé par clean_all_communes)
+        - reponses_supprimees : réponses supprimées par le nettoyage (index de la réponse dans df) et motif de la suppression
+        - adresses_ip : adresses ip identiques (voir analyse_ip)
+        - rafales : rafales de réponses (voir detect_response_bursts)
+        - commentaires : commentaires qualitatifs des communes inspectées (filtrées ou à sauvegarder)
+    ENTREES :
+        - ip_communes, burst_communes (np.array) : numéro de la commune (ligne de communes) de chaque ligne de ip_table et bursts"""
+    group = rows["commune"].to_numpy()
+    valid = group >= 0
+    row_group = np.maximum(group, 0)
+    eligible, retained = communes["Commune évaluée"].to_numpy(), communes["Commune retenue"].to_numpy()
+    kept, ip_fraud = rows["conservée"].to_numpy(), rows["filtrage ip"].to_numpy()
+    removed = valid & ~(kept & retained[row_group])
+    reasons = np.select([~eligible[row_group], ip_fraud, kept],
+                        ["nombre de contributions insuffisant", "filtrage ip", "commune éliminée après nettoyage"],
+                        default="filtrage distribution")
+    insee = communes["insee"].to_numpy()
+    removed_rows = pd.DataFrame({"insee": insee[group[removed]], "index": df.index[removed],
+                                 avg_note_att_name: df[avg_note_att_name].to_numpy()[removed], "motif": reasons[removed]})
+    with_comment = valid & communes["Commune inspectée"].to_numpy()[row_group] & df[commentaire_id].notna().to_numpy()
+    commentaries = pd.DataFrame({"insee": insee[group[with_comment]], "index": df.index[with_comment],
+                                 avg_note_att_name: df[avg_note_att_name].to_numpy()[with_comment],
+                                 ip_id: df[ip_id].astype(str).to_numpy()[with_comment],
+                                 commentaire_id: df[commentaire_id].astype(str).to_numpy()[with_comment]})
+    tables = {"communes": (communes, np.arange(len(communes))),
+              "reponses_supprimees": (removed_rows, group[removed]),
+              "adresses_ip": (ip_table.rename(columns={commune_id: "insee"}), ip_communes),
+              "rafales": (bursts.rename(columns={commune_id: "insee"}), burst_communes),
+              "commentaires": (commentaries, group[with_comment])}
+    # lignes de chaque table regroupées par commune (dans l'ordre des communes)
+    for name, (table, table_communes) in tables.items():
+        order = np.argsort(table_communes, kind="stable")
+        tables[name] = (table.iloc[order], table_communes[order])
+    with AuditStore(audit_fold) as audit:
+        for start in range(0, max(len(communes), 1), batch_size):
+            for name, (table, table_communes) in tables.items():
+                batch = slice(*np.searchsorted(table_communes, [start, start + batch_size]))
+                audit.append(name, table.iloc[batch])
+
+
 def filter_data_set(df, questions_to_average, commune_id, commentaire_id, ip_id, email_id, save_key, insee_refs, histo_save_fold,
-                    communes_to_save, communes_to_filter=[], communes_not_to_filter=[], nb_contribution_min=[30,50], avg_note_att_name="average_note"):
+                    communes_to_save, communes_to_filter=[], communes_not_to_filter=[], nb_contribution_min=[30,50], avg_note_att_name="average_note",
+                    workers=1, incremental=True, render_fmt="png"):
     """Applique la méthodologie de nettoyage des données à l'ensemble des communes, écris les données nettoyées sur le S3 et
-    sauvegarde en local les histogrames des notes moyennes (avant et après filtrage) de certaines communes, à savoir les communes spéccifiées par la variable
+    sauvegarde en local les données des histogrames des notes moyennes (avant et après filtrage) de certaines communes, à savoir les communes spéccifiées par la variable
     commune_to_save, et les communes pour lesquels une fraude potentiel a été detectée. La méthodologie de nettoyage est effectuée par la
-    fonction filter_one_commune_2025_method.
+    fonction filter_one_commune_2025_method. Les figures des histogrammes sont produites à partir de ces données, après le
+    nettoyage, par render_histograms (voir rendu_histogrammes.py).
     ENTREES:
         - df (pd.DataFrame), Shape (Nombre de réponses, Nombre de questions).
             Data Frame pandas contenant l'ensemble des réponses au questionnaire de la FUB. Shape
@@ -140,11 +576,14 @@ def filter_data_set(df, questions_to_average, commune_id, commentaire_id, ip_id,
         - commune_id (str). Nom de la colonne associée à la question demandant la commune à évaluer
         - commentaire_id (str). Nom de la colonne associé aux commentaires qualitatifs
         - save_key (str). Chemin de sauvegarde des données nettoyées sur le S3
-        - insee_refs (pd.DataFrame). Tableau pandas associant les codes INSEE au nom de commune et autres caractéristiques de la commune
+        - insee_refs (pd.DataFrame ou CommuneRegistry). Tableau pandas associant les codes INSEE au nom de commune et autres caractéristiques de la commune
         - histo_save_fold : chemin (en local) de sauvegarde des histogrammes des notes moyennes. Le dossier est séparé en 3
             sous-dossier, dans le dossier "potential_fraud_detected" sont sauvegardés les communes pour lesquelles une fraude potentielle a été detecté.
             Dans le dossier "specified_communes" sont sauvegardées les communes pour lesquelles spécifiées dans la liste communes_to_save.
-            Dans le dossier "identical_ip" sont sauvegardées des csv associées à des contributions avec adresse ip identiques.
+            Les données des histogrammes de ces communes (voir get_commune_diagnostics) sont sauvegardées dans le fichier _histogrammes.pkl.
+            L'ensemble des diagnostics (décisions et statistiques de chaque commune, réponses supprimées, adresses ip identiques,
+            rafales de réponses, commentaires qualitatifs des communes inspectées) est sauvegardé dans les tables Parquet du
+            sous-dossier "audit" (voir save_audit et audit_nettoyage.py).
         - commune_to_save (list de str). Liste contenant les noms de communes pour lesquelles l'on souhaite sauvegarder les histogrammes des notes moyennes.
          En plus des communes de la liste seont sauverardée les histogrammes des communes pour lesquels il y a une fraude potentielle
         - communes_to_filter (list de str) : communes pour lesquelles on souhaite supprimer les valeures extrême quoi qu'il arrive
@@ -153,77 +592,113 @@ def filter_data_set(df, questions_to_average, commune_id, commentaire_id, ip_id,
                     que nb_contribution_min[0] sont supprimées. Toutes les communes de plus de 5000 habitants ayant moins de
                     contributions que nb_contribution_min[1] sont supprimées
         - avg_note_att_name (str) : un attribut "note moyenne" est ajouté au tableau, avg_note_att_name est le nom de cet attribut
+        - workers (int) : nombre de processus utilisés pour calculer les diagnostics des communes et pour tracer les
+            histogrammes. Les résultats (données nettoyées, fichier _potentielles_fraudes.csv) sont identiques quel que soit le
+            nombre de processus
+        - incremental (bool) : si True, l'empreinte de chaque commune (hash de ses réponses et des paramètres de nettoyage) et
+            les résultats associés (décisions de filtrage, statistiques ajustées, données des histogrammes) sont
+            conservés dans le fichier _cache_nettoyage.pkl de histo_save_fold. Lors des exécutions suivantes, les diagnostics
+            ne sont recalculés que pour les communes dont l'empreinte a changé. Supprimer ce fichier pour tout recalculer
+        - render_fmt (str ou None) : format des figures des histogrammes ("png", "svg" ou "vega", voir render_histograms).
+            Si None, seules les données des histogrammes sont sauvegardées (figures à produire ensuite avec render_histograms)
     SORTIES:
         - all_filtered_data (pd.DataFrame). Le tableau pandas contenant les données netoyées
     """
     make_dir(histo_save_fold)
     #df = df.dropna(subset=questions_to_average)
     insee_codes = df[commune_id].unique()
-    all_filtered_data = []
     print('nombre de communes avec au moins 1 contribution', len(insee_codes))
-    potential_fraudulous_communes = pd.DataFrame(columns=["Nom commune", "Commune éliminée après nettoyage", "Nombre de contributions supprimées",
+    df = df.dropna(subset=questions_to_average)
+    # moyennage de l'ensemble des critères d'évaluation
+    # conversion en float64 : les moyennes de notes stockées en "Int8" (voir schema_donnees.py) sont de type "Float64"
+    df[avg_note_att_name] = df[questions_to_average].mean(axis=1).astype("float64")
+    registry = insee_refs if isinstance(insee_refs, CommuneRegistry) else CommuneRegistry(insee_refs)
+    communes, rows = clean_all_communes(df, insee_codes, commune_id, ip_id, commentaire_id, email_id, registry,
+                                        communes_to_filter, communes_not_to_filter, nb_contribution_min, avg_note_att_name)
+
+    # réponses conservées, regroupées par commune (dans l'ordre de insee_codes)
+    kept_positions = np.flatnonzero(rows["conservée"].to_numpy()
+                                    & communes["Commune retenue"].to_numpy()[np.maximum(rows["commune"].to_numpy(), 0)])
+    kept_positions = kept_positions[np.argsort(rows["commune"].to_numpy()[kept_positions], kind="stable")]
+    all_filtered_data = df.iloc[kept_positions].reset_index(drop=True)
+
+    # diagnostics (données des histogrammes, adresses ip identiques, commentaires) des communes concernées
+    # un seul tableau pour les adresses ip identiques de toutes les communes
+    ip_table = analyse_ip(df, commune_id, ip_id, commentaire_id, email_id, avg_note_att_name)
+    ip_communes = pd.Index(np.asarray(insee_codes, dtype=object)).get_indexer(ip_table[commune_id].astype(object))
+    ip_table.insert(1, "Nom commune", communes["Nom commune"].to_numpy()[ip_communes])
+    ip_table.insert(2, "Commune évaluée", communes["Commune évaluée"].to_numpy()[ip_communes])
+    with_identical_ip = np.zeros(len(communes), dtype=bool)
+    with_identical_ip[ip_communes] = True
+    filtered_any = communes["filtrage ip"] | communes["filtrage distribution"]
+    to_inspect = communes["Commune évaluée"] & (filtered_any | communes["Nom commune"].isin(communes_to_save))
+    order = np.argsort(rows["commune"].to_numpy(), kind="stable")
+    shared = {"df": df, "rows": rows, "communes": communes, "order": order,
+              "starts": np.searchsorted(rows["commune"].to_numpy()[order], np.arange(len(communes) + 1)),
+              "filtered_any": filtered_any.to_numpy(), "with_identical_ip": with_identical_ip,
+              "communes_to_save": communes_to_save, "histo_save_fold": histo_save_fold, "ip_id": ip_id,
+              "commentaire_id": commentaire_id, "email_id": email_id, "avg_note_att_name": avg_note_att_name}
+    communes_to_inspect = np.flatnonzero(to_inspect.to_numpy())
+    cache_path = f'{histo_save_fold}/_cache_nettoyage.pkl'
+    cache = pd.read_pickle(cache_path) if incremental and os.path.exists(cache_path) else {}
+    shared["fingerprints"] = get_communes_fingerprints(df, communes, shared["order"], shared["starts"], communes_to_inspect,
+                                                       [questions_to_average, ip_id, commentaire_id, email_id, avg_note_att_name,
+                                                        communes_to_save, communes_to_filter, communes_not_to_filter, nb_contribution_min])
+    # seules les communes dont l'empreinte a changé sont recalculées
+    results = {}
+    for g in communes_to_inspect:
+        cached = cache.get(communes["insee"].iloc[g])
+        # les entrées avec des chemins de fichiers ("fichiers") datent des versions qui traçaient les figures pendant le nettoyage
+        if cached is not None and cached["empreinte"] == shared["fingerprints"][g] and "fichiers" not in cached:
+            results[g] = cached["diagnostics"]
+    communes_to_compute = [g for g in communes_to_inspect if g not in results]
+    print('Nombre de communes à (re)calculer', len(communes_to_compute), 'sur', len(communes_to_inspect))
+    if workers > 1 and len(communes_to_compute) > 1:
+        # les données ne sont transmises qu'une seule fois à chaque processus (à sa création), chaque tâche ne reçoit que le
+        # numéro d'une commune. Les résultats sont renvoyés dans l'ordre des communes, comme en exécution séquentielle.
+        with ProcessPoolExecutor(max_workers=workers, initializer=init_diagnostics_worker, initargs=(shared,)) as executor:
+            results.update(zip(communes_to_compute, executor.map(get_commune_diagnostics_in_worker, communes_to_compute,
+                                                                 chunksize=max(1, len(communes_to_compute) // (4*workers))),
+                               strict=True))
+    else:
+        results.update((g, get_commune_diagnostics(g, shared)) for g in communes_to_compute)
+    if incremental:
+        communes_records = communes.to_dict("records")
+        pd.to_pickle({communes["insee"].iloc[g]: {"empreinte": shared["fingerprints"][g], "commune": communes_records[g],
+                                                  "diagnostics": results[g]}
+                      for g in communes_to_inspect}, cache_path)
+    results = [results[g] for g in communes_to_inspect]
+    # données des histogrammes, tracés par render_histograms (voir rendu_histogrammes.py)
+    pd.to_pickle([histogram for _, _, histogram in results if histogram is not None], f'{histo_save_fold}/_histogrammes.pkl')
+    if render_fmt is not None:
+        render_histograms(histo_save_fold, fmt=render_fmt, workers=workers, incremental=incremental)
+    potential_fraudulous_communes = [row for row, _, _ in results if row is not None]
+    fraudulous_communes = [g for g, (row, _, _) in zip(communes_to_inspect, results, strict=True) if row is not None]
+    communes_with_identical_ip = communes["Nom commune"][with_identical_ip & communes["Commune évaluée"].to_numpy()]
+
+    # rafales de réponses (fenêtres de temps avec un nombre anormalement élevé de réponses)
+    bursts = detect_response_bursts(df, commune_id)
+    burst_communes = pd.Index(np.asarray(insee_codes, dtype=object)).get_indexer(bursts[commune_id].astype(object))
+    bursts.insert(1, "Nom commune", communes["Nom commune"].to_numpy()[burst_communes])
+    nb_bursts = np.bincount(burst_communes, minlength=len(communes))
+
+    potential_fraudulous_communes = pd.DataFrame(potential_fraudulous_communes,
+                                                 columns=["Nom commune", "Commune éliminée après nettoyage", "Nombre de contributions supprimées",
                                                           "Nombre de contributions avant nettoyage",
                                                           "Nombre de contributions après nettoyage",
                                                           "filtrage ip", "filtrage distribution"])
-    communes_with_identical_ip = []
-    df = df.dropna(subset=questions_to_average)
-    for insee_code in insee_codes:
-        nom_commune, _, population, _ = get_commune_name_from_insee(insee_code, insee_refs)
-        df_commune = df[df[commune_id] == insee_code].copy()
-        n_min = nb_contribution_min[0] if population <= 5000 else nb_contribution_min[1]
-        if len(df_commune) >= n_min:
-            df_commune[avg_note_att_name] = df_commune[questions_to_average].mean(axis=1)
-            filtered, df_ip_doublon_view, fraudulous_ip, filter_ip = filter_one_commune_ip(df_commune, ip_id, commentaire_id, email_id, avg_note_att_name)
-
-            # moyennage de l'ensemble des critères d'évaluation
-            filtered, filter_distr, adjusted_mean, adjusted_std, largest_queue = filter_one_commune_2025_method(filtered,nom_commune,
-                                                                                                                communes_to_filter, communes_not_to_filter, avg_note_att_name)
-            filter = (filter_distr or filter_ip)
-            if len(df_ip_doublon_view) > 0:
-                save_fold_ip = f'{histo_save_fold}/identical_ip'
-                make_dir(save_fold_ip)
-                communes_with_identical_ip.append(nom_commune)
-                df_ip_doublon_view.to_csv(f'{save_fold_ip}/identical_ip_{nom_commune}.csv')
-                if filter_ip:
-                    pd.DataFrame(fraudulous_ip).to_csv(f'{save_fold_ip}/fraudoulous_ip_{nom_commune}.csv')
-
-            save_folds = np.array([f'{histo_save_fold}/specified_communes', f'{histo_save_fold}/potential_fraud_detected'])
-            save_folds = save_folds[[nom_commune in communes_to_save, filter]]
-            if filter:
-                row = [nom_commune, len(filtered)<n_min, len(df_commune)-len(filtered), len(df_commune), len(filtered), filter_ip, filter_distr]
-                potential_fraudulous_communes.loc[len(potential_fraudulous_communes)] = row
-            for save_fold in save_folds:
-                make_dir(save_fold)
-                plot_histo(df_commune[avg_note_att_name],1,6,0.2, adjusted_mean, adjusted_std,
-                           f"Distribution de la note moyenne pour la commune {nom_commune} (avant filtrage)",
-                           f'{save_fold}/histo_avg_notes_{nom_commune}_avant_filtrage.png')
-
-                plot_histo(filtered[avg_note_att_name], 1, 6, 0.2, adjusted_mean, adjusted_std,
-                           f"Distribution de la note moyenne pour la commune {nom_commune} (après filtrage)",
-                           f'{save_fold}/histo_avg_notes_{nom_commune}_après_filtrage.png')
-
-                plot_histo_response_time(df_commune, f'{save_fold}/histo_time_response_{nom_commune}.png',
-                                         largest_queue, nom_commune)
-                commentaries = df_commune[[avg_note_att_name, ip_id, commentaire_id]].dropna(subset=[commentaire_id])
-                commentaries.to_csv(f'{save_fold}/commentraires_qualitatifs_{nom_commune}.csv')
-                if len(df_ip_doublon_view) > 0:
-                    df_ip_doublon_view.to_csv(f'{save_fold}/identical_ip_{nom_commune}.csv')
-
-
-
-            if len(filtered) >= n_min:
-                all_filtered_data.append(filtered)
-    print('Nombre de communes qualifiées', len(all_filtered_data))
+    potential_fraudulous_communes["Nombre de rafales de réponses"] = nb_bursts[fraudulous_communes]
+    communes["Adresses ip identiques"] = with_identical_ip
+    communes["Nombre de rafales de réponses"] = nb_bursts
+    communes["Commune inspectée"] = to_inspect
+    save_audit(f'{histo_save_fold}/audit', df, communes, rows, ip_table, ip_communes, bursts, burst_communes,
+               commune_id, ip_id, commentaire_id, avg_note_att_name)
+    print('Nombre de communes qualifiées', communes["Commune retenue"].sum())
     print('Nombre de communes potentiellement frauduleuse', len(potential_fraudulous_communes))
     print('Nombre de communes avec des ips identiques', len(communes_with_identical_ip))
-    #print('Communes avec des ips identiques', communes_with_identical_ip)
-    #print('Communes avec des ips identiques, qui n"ont pas été détectées frauduleuse',
-          #[c for c in communes_with_identical_ip if c not in potential_fraudulous_communes])
+    print('Nombre de communes avec des rafales de réponses', (nb_bursts > 0).sum())
     potential_fraudulous_communes = potential_fraudulous_communes.sort_values(by="Nombre de contributions supprimées", ascending=False)
-    #potential_fraudulous_communes = potential_fraudulous_communes.sort_values(by="Nom commune",
-                                 #                                             ascending=False)
     potential_fraudulous_communes.to_csv(f'{histo_save_fold}/_potentielles_fraudes.csv')
-    all_filtered_data = pd.concat(all_filtered_data, ignore_index=True)
     # all_filtered_data.to_csv("/home/thibaut/filtered.csv", index=False)
     # write_csv_on_s3(all_filtered_data, save_key)
     return all_filtered_data
@@ -257,81 +732,92 @@ def compute_adjusted_mean_std(df, commune_name):
     return adjusted_mean, adjusted_std
 
 
-def plot_histo(values, start, stop, step, adjusted_mean, adjusted_std, title, save_path):
-    """trace l'histogramme des valeures de values et superpose cet histogramme avec une distribution gaussienne de
-     moyenne adjusted_mean et d'ecart type adjusted_std"""
-    # Données pour la gaussienne
-    x = np.linspace(start, stop, 1000)
-    bin_width = step
-    n = len(values)
-    y = norm.pdf(x, adjusted_mean, adjusted_std) * n * bin_width  # Ajustement à l'échelle des effectifs
-
-    # Création de l'histogramme
+def get_notes_histogram(values, start, stop, step):
+    """Effectifs de l'histogramme des valeurs de values, pour des intervalles de largeur step entre start et stop (mêmes
+    intervalles que plt.hist(values, bins=np.arange(start, stop + step, step)))
+    SORTIES :
+        - bins (np.array) : bornes des intervalles
+        - counts (np.array) : nombre de valeurs dans chaque intervalle"""
     bins = np.arange(start, stop + step, step)
-    plt.figure(figsize=(10, 6))
-    plt.hist(values, bins=bins, alpha=0.6, color='skyblue', edgecolor='black',
-             label='Histogramme des notes')
-
-    # Tracé de la courbe gaussienne
-    plt.plot(x, y, 'r-', label='Distribution gaussienne')
-
-    # Tracé des lignes verticales pointillées
-    plt.axvline(adjusted_mean, color='black', linestyle='--', linewidth=1.5, label='Moyenne ajustée')
-    plt.axvline(adjusted_mean - 2 * adjusted_std, color='gray', linestyle='--', linewidth=1.2, label='-2 écarts-types')
-    plt.axvline(adjusted_mean + 2 * adjusted_std, color='gray', linestyle='--', linewidth=1.2, label='+2 écarts-types')
-
-    # Légendes et affichage
-    plt.title(title)
-    plt.xlabel("Note moyenne")
-    plt.ylabel("Nombre de réponses")
-    plt.legend()
-    plt.grid(True)
-    plt.savefig(save_path)
-    plt.close()
-
-
-def plot_histo_response_time(df_commune, save_path, largest_queue, nom_commune, x=12):
-    """trace l'histogramme des dates de remplissage du formulaire.
+    counts, _ = np.histogram(values, bins=bins)
+    return bins, counts.astype(np.int32)
+
+
+def get_response_time_histogram(df_commune, largest_queue_mask, x=12):
+    """Effectifs de l'histogramme des dates de remplissage du formulaire, par intervalles de x heures à partir de l'heure de
+    la première réponse (mêmes intervalles que pd.cut(dates, bins=pd.date_range(debut, fin, freq=f'{x}h'), right=False)).
     ENTREES :
         df_commune (pd.DataFrame) : sous-ensemble du questionnaire
-        save_path (str) : localisation de sauvegarde de l'histogramme
-        x (int) : nombre d'heures dans un intervalle de l'histogramme"""
-    # Conversion de la colonne 'date' en datetime
+        largest_queue_mask (np.array de bool) : réponses de df_commune appartenant à la plus grande queue de distribution
+        x (int) : nombre d'heures dans un intervalle de l'histogramme
+    SORTIES :
+        - time_start (pd.Timestamp) : début du premier intervalle (NaT s'il n'y a aucune date)
+        - counts, counts_largest_queue (np.array) : nombre de réponses (de la plus grande queue) dans chaque intervalle"""
     dates = pd.to_datetime(df_commune["date"], errors='coerce')
-    dates = dates.dropna()
-
-    # Regrouper les dates par tranche de x heures
-    bins = pd.date_range(start=dates.min().floor('h'),
-                         end=dates.max().ceil('h'),
-                         freq=f'{x}h')
-
-    # Histogramme : découpe les dates selon les intervalles
-    counts, _ = pd.cut(dates, bins=bins, right=False, retbins=True)
-    hist = counts.value_counts().sort_index()
-
-    dates_largest_queue = pd.to_datetime(largest_queue["date"], errors='coerce').dropna()
-    counts_largest_queue, _ = pd.cut(dates_largest_queue, bins=bins, right=False, retbins=True)
-    hist_largest_queue = counts_largest_queue.value_counts().sort_index()
-
-
-    # Tracer l'histogramme
-    plt.figure(figsize=(12, 6))
-    plt.bar([interval.left for interval in hist.index], hist.values, width=pd.Timedelta(hours=x))
-    plt.bar([interval.left for interval in hist_largest_queue.index], hist_largest_queue.values, width=pd.Timedelta(hours=x), color='orange')
-    plt.gcf().autofmt_xdate()
-    plt.xlabel(f"Date (pas de {x} heures)")
-    plt.ylabel("Nombre d'événements")
-    plt.title(f"Histogramme des dates de réponse {nom_commune} ({x}h)")
-    plt.tight_layout()
-    plt.savefig(save_path)
-    plt.close()
+    valid = dates.notna().to_numpy()
+    if not valid.any():
+        return pd.NaT, np.zeros(0, dtype=np.int32), np.zeros(0, dtype=np.int32)
+    time_start, time_end = dates.min().floor('h'), dates.max().ceil('h')
+    n_bins = (time_end - time_start) // pd.Timedelta(hours=x)  # la dernière borne est la dernière avant time_end
+    bin_ids = ((dates[valid] - time_start) // pd.Timedelta(hours=x)).to_numpy()
+    in_bins = bin_ids < n_bins
+    counts = np.bincount(bin_ids[in_bins], minlength=n_bins)
+    counts_largest_queue = np.bincount(bin_ids[in_bins & largest_queue_mask[valid]], minlength=n_bins)
+    return time_start, counts.astype(np.int32), counts_largest_queue.astype(np.int32)
+
+
+def detect_response_bursts(df, commune_id, date_id="date", window_hours=12, alpha=10**-6, min_count=5):
+    """Détecte les rafales de réponses : fenêtres de temps pendant lesquelles une commune reçoit anormalement beaucoup de
+    réponses. Les dates sont analysées une seule fois, chaque réponse est associée à une fenêtre de window_hours heures
+    (arithmétique entière sur les dates), et les réponses sont comptées par couple (commune, fenêtre) non vide.
+    Le nombre de réponses attendu dans une fenêtre suit le rythme national de la campagne : en l'absence de rafale, le nombre
+    de réponses d'une commune dans la fenêtre w suit une loi binomiale B(N, p_w), avec N le nombre total de réponses de la
+    commune et p_w la part des réponses nationales reçues pendant la fenêtre w. Une fenêtre est anormale si son nombre de
+    réponses dépasse le seuil k tel que P(Y>k) = alpha et vaut au moins min_count.
+    ENTREES :
+        - df (pd.DataFrame) : réponses
+        - commune_id, date_id (str) : colonnes associées à la commune et à la date de réponse
+        - window_hours (int) : durée d'une fenêtre, en heures
+        - alpha (float) : seuil du test (il y a autant de tests que de couples (commune, fenêtre), d'où une valeur faible)
+        - min_count (int) : nombre minimal de réponses d'une fenêtre anormale
+    SORTIE :
+        bursts (pd.DataFrame) : une ligne par fenêtre anormale, avec la commune, le début de la fenêtre, le nombre de réponses,
+            le nombre de réponses attendu et le seuil du test"""
+    dates = df[date_id] if pd.api.types.is_datetime64_any_dtype(df[date_id]) else pd.to_datetime(df[date_id], errors="coerce")
+    valid = (dates.notna() & df[commune_id].notna()).to_numpy()
+    commune_codes, communes = pd.factorize(df[commune_id].to_numpy()[valid])
+    columns = [commune_id, "Début de la fenêtre", "Nombre de réponses", "Nombre de réponses attendu", "Seuil"]
+    if len(commune_codes) == 0:
+        return pd.DataFrame(columns=columns)
+    times = dates.to_numpy()[valid].astype("datetime64[ns]").astype("int64")
+    start = pd.Timestamp(times.min()).floor("h").value
+    window_ns = window_hours * 3600 * 10**9
+    windows = (times - start) // window_ns
+    # seuls les couples (commune, fenêtre) non vides sont comptés : une date aberrante (ex : 1970) ajoute des fenêtres vides
+    # mais pas de couples
+    n_windows = int(windows.max()) + 1
+    cells, counts = np.unique(commune_codes.astype(np.int64) * n_windows + windows, return_counts=True)
+    commune_idx, window_idx = np.divmod(cells, n_windows)
+    totals = np.bincount(commune_codes, minlength=len(communes))
+    national_windows, national_counts = np.unique(windows, return_counts=True)
+    national_share = national_counts[np.searchsorted(national_windows, window_idx)] / len(windows)
+    # seuils calculés directement pour chaque couple (la part p_w de chaque fenêtre est différente : une table de seuils
+    # par fenêtre, voir BinomialThresholds, ne serait jamais réutilisée)
+    thresholds = binom.ppf(1 - alpha, totals[commune_idx], national_share).astype(int)
+    anomalous = (counts > thresholds) & (counts >= min_count)
+    return pd.DataFrame({commune_id: communes[commune_idx[anomalous]],
+                         "Début de la fenêtre": pd.to_datetime(start + window_idx[anomalous] * window_ns),
+                         "Nombre de réponses": counts[anomalous],
+                         "Nombre de réponses attendu": totals[commune_idx[anomalous]] * national_share[anomalous],
+                         "Seuil": thresholds[anomalous]}, columns=columns)
 
 
 if __name__ == '__main__':
     data_2025 = True # = True si on souhaite nettoyer les données de 2025, =False si on souhaite nettoyer les données de 2021
 
-    data = preview_file(key="data/converted/2025/brut/250604_Export_Reponses_Brut_Final_Result 1.csv", nrows=None, csv_sep=",") \
-        if data_2025 else preview_file(key="data/converted/2021/brut/reponses-2021-12-01-08-00-00.csv", nrows=None)
+    data = preview_file(key="data/converted/2025/brut/250604_Export_Reponses_Brut_Final_Result 1.csv", nrows=None, csv_sep=",",
+                        schema="2025") \
+        if data_2025 else preview_file(key="data/converted/2021/brut/reponses-2021-12-01-08-00-00.csv", nrows=None, schema="2021")
 
     print('loaded')
     # print('col insee', insee_refs.columns)
@@ -0,0 +1,176 @@
+import numpy as np
+import pandas as pd
+from nettoyage_donnees import binomial_thresholds
+from utils import CommuneRegistry
+
+"""Suivi en direct des indicateurs de fraude pendant la campagne du baromètre.
+
+Les nouvelles réponses sont ajoutées par petits lots (méthode update). Pour chaque commune, on conserve :
+    - le nombre, la somme et la somme des carrés des notes moyennes (average_note)
+    - le nombre de réponses par couple (adresse ip, somme des notes). La note moyenne d'une réponse étant la somme (entière) de
+        ses notes divisée par le nombre de questions, ce comptage décrit exactement la distribution des notes moyennes de la
+        commune : les queues de distribution et les adresses ip identiques s'en déduisent sans conserver les réponses
+    - le nombre de réponses par heure
+Après chaque lot, les indicateurs de filter_one_commune_ip et filter_one_commune_2025_method ne sont recalculés que pour les
+communes ayant reçu de nouvelles réponses. Les statistiques sont calculées à partir des comptages (et non réponse par réponse) :
+elles peuvent donc différer de filter_data_set au dernier chiffre près, filter_data_set reste la référence pour le nettoyage final."""
+
+
+class SuiviEnDirect:
+    def __init__(self, questions_to_average, commune_id="insee", ip_id="ip", date_id="date", insee_refs=None,
+                 communes_to_filter=(), communes_not_to_filter=(), nb_contribution_min=(30, 50), alpha=8*10**-4, beta=2,
+                 x=2, y=5):
+        """ENTREES :
+            - questions_to_average (list) : questions dont la moyenne donne la note moyenne d'une réponse
+            - commune_id, ip_id, date_id (str) : colonnes associées à la commune, à l'adresse ip et à la date de réponse
+            - insee_refs (pd.DataFrame ou CommuneRegistry, optionnel) : tableau des communes, pour les noms et populations
+            - les autres arguments sont ceux de filter_data_set, filter_one_commune_ip et filter_one_commune_2025_method"""
+        self.questions_to_average = questions_to_average
+        self.commune_id, self.ip_id, self.date_id = commune_id, ip_id, date_id
+        self.registry = insee_refs if insee_refs is None or isinstance(insee_refs, CommuneRegistry) else CommuneRegistry(insee_refs)
+        self.communes_to_filter, self.communes_not_to_filter = communes_to_filter, communes_not_to_filter
+        self.nb_contribution_min, self.alpha, self.beta, self.x, self.y = nb_contribution_min, alpha, beta, x, y
+        self.stats = pd.DataFrame(columns=["count", "sum", "sumsq"], dtype="float64")
+        self.note_counts = None  # pd.Series d'index (commune, ip, somme des notes)
+        self.hourly_counts = None  # pd.Series d'index (commune, heure)
+
+    def update(self, batch):
+        """Ajoute un lot de nouvelles réponses et recalcule les indicateurs des communes concernées.
+        ENTREE :
+            batch (pd.DataFrame) : nouvelles réponses (les réponses avec une note manquante sont ignorées, comme dans filter_data_set)
+        SORTIE :
+            indicators (pd.DataFrame) : indicateurs des communes ayant reçu de nouvelles réponses (voir evaluate)"""
+        batch = batch.dropna(subset=self.questions_to_average + [self.commune_id])
+        if len(batch) == 0:
+            return self.evaluate([])
+        note_sum = np.rint(batch[self.questions_to_average].astype("float64").sum(axis=1)).astype("int64")
+        average_note = note_sum / len(self.questions_to_average)
+        communes = batch[self.commune_id].astype(object)
+        ips = batch[self.ip_id].astype(object).fillna("") if self.ip_id in batch.columns else pd.Series("", index=batch.index)
+
+        batch_stats = pd.DataFrame({"count": 1.0, "sum": average_note, "sumsq": average_note**2}).groupby(communes).sum()
+        self.stats = self.stats.add(batch_stats, fill_value=0)
+        batch_counts = note_sum.groupby([communes, ips, note_sum]).size()
+        self.note_counts = add_counts(self.note_counts, batch_counts)
+        if self.date_id in batch.columns:
+            hours = pd.to_datetime(batch[self.date_id], errors="coerce").dt.floor("h")
+            self.hourly_counts = add_counts(self.hourly_counts, hours.groupby([communes, hours]).size())
+        return self.evaluate(batch_stats.index)
+
+    def evaluate(self, communes=None):
+        """Calcule les indicateurs de fraude de certaines communes (de toutes les communes si communes vaut None).
+        SORTIE :
+            indicators (pd.DataFrame) : une ligne par commune, avec le nombre de réponses, la moyenne et l'écart-type des notes
+                moyennes, le nombre d'adresses ip frauduleuses (au sens de filter_one_commune_ip) et, après suppression des
+                réponses associées, la moyenne et l'écart-type ajustés, les tailles des queues supérieures et inférieures,
+                le seuil binomial et la décision de filtrage (au sens de filter_one_commune_2025_method), ainsi que le
+                nombre maximal de réponses reçues en une heure"""
+        communes = self.stats.index if communes is None else pd.Index(communes)
+        n_questions = len(self.questions_to_average)
+        counts = self.note_counts[self.note_counts.index.get_level_values(0).isin(communes)] \
+            if self.note_counts is not None else pd.Series(dtype="int64", index=pd.MultiIndex.from_tuples([], names=[None]*3))
+        commune, ip = counts.index.get_level_values(0), counts.index.get_level_values(1)
+        values = counts.index.get_level_values(2).to_numpy() / n_questions
+        weights = counts.to_numpy()
+
+        # adresses ip frauduleuses : au moins max(x, y) réponses, de note moyenne supérieure à 5 ou inférieure à 2
+        ip_n = pd.Series(weights).groupby([commune, ip]).transform("sum").to_numpy()
+        ip_mean = pd.Series(weights * values).groupby([commune, ip]).transform("sum").to_numpy() / ip_n
+        fraud = (ip_n >= self.x) & (ip_n >= self.y) & ((ip_mean >= 5) | (ip_mean <= 2)) & (ip != "")
+        nb_fraudulous_ip = pd.Series(ip[fraud]).groupby(commune[fraud]).nunique().reindex(communes, fill_value=0)
+
+        # distribution des notes moyennes après suppression des réponses des adresses ip frauduleuses
+        remaining = ~fraud
+        commune, values, weights = commune[remaining], values[remaining], weights[remaining]
+        adjusted_mean, adjusted_std = adjusted_mean_std_from_counts(commune, values, weights)
+        upper_limit = (adjusted_mean + 2*adjusted_std).reindex(commune).to_numpy()
+        lower_limit = (adjusted_mean - 2*adjusted_std).reindex(commune).to_numpy()
+
+        def group_sum(w):
+            return pd.Series(w).groupby(commune).sum().reindex(communes, fill_value=0).astype(int)
+
+        n_sample = group_sum(weights)
+        n_upper, n_lower = group_sum(np.where(values >= upper_limit, weights, 0)), group_sum(np.where(values <= lower_limit, weights, 0))
+        k = binomial_thresholds(n_sample.to_numpy(), self.alpha)
+
+        if self.registry is not None:
+            communes_info = self.registry.lookup_many(communes)
+            noms_communes, populations = communes_info["Commune"].to_numpy(dtype=object), communes_info["Population"].to_numpy()
+        else:
+            noms_communes, populations = communes.to_numpy(dtype=object), np.full(len(communes), 4000)
+        n_min = np.where(populations <= 5000, self.nb_contribution_min[0], self.nb_contribution_min[1])
+        filter_distr = ~np.isin(noms_communes, self.communes_not_to_filter) & \
+            ((n_upper.to_numpy() >= self.beta*k) | (n_lower.to_numpy() >= self.beta*k) | np.isin(noms_communes, self.communes_to_filter))
+
+        stats = self.stats.reindex(communes)
+        count, total, total_sq = stats["count"].to_numpy(), stats["sum"].to_numpy(), stats["sumsq"].to_numpy()
+        with np.errstate(invalid="ignore", divide="ignore"):
+            std = np.where(count > 1, np.sqrt(np.maximum(total_sq - total**2/count, 0) / (count - 1)), 0)
+        max_hourly = self.hourly_counts[self.hourly_counts.index.get_level_values(0).isin(communes)].groupby(level=0).max() \
+            .reindex(communes, fill_value=0) if self.hourly_counts is not None else pd.Series(0, index=communes)
+        return pd.DataFrame({"insee": communes,
+                             "Nom commune": noms_communes,
+                             "Nombre de contributions": count.astype(int),
+                             "Commune évaluée": count >= n_min,
+                             "Moyenne": total/count,
+                             "Ecart-type": std,
+                             "Nombre d'ip frauduleuses": nb_fraudulous_ip.to_numpy(),
+                             "filtrage ip": nb_fraudulous_ip.to_numpy() > 0,
+                             "Moyenne ajustée": adjusted_mean.reindex(communes).to_numpy(),
+                             "Ecart-type ajusté": adjusted_std.reindex(communes).to_numpy(),
+                             "Queue supérieure": n_upper.to_numpy(),
+                             "Queue inférieure": n_lower.to_numpy(),
+                             "Seuil binomial": k,
+                             "filtrage distribution": filter_distr,
+                             "Nombre maximal de réponses en une heure": max_hourly.to_numpy()})
+
+    def get_hourly_histogram(self, commune):
+        """Nombre de réponses par heure d'une commune (pd.Series indexée par heure)"""
+        if self.hourly_counts is None or commune not in self.hourly_counts.index.get_level_values(0):
+            return pd.Series(dtype="int64")
+        return self.hourly_counts.loc[commune]
+
+
+def add_counts(counts, new_counts):
+    """Ajoute des comptages (pd.Series à index multiple) à des comptages existants (None s'il n'y en a pas encore)"""
+    new_counts = new_counts.rename_axis([None] * new_counts.index.nlevels)
+    if counts is None:
+        return new_counts.sort_index()
+    return counts.add(new_counts, fill_value=0).astype("int64")
+
+
+def adjusted_mean_std_from_counts(communes, values, weights):
+    """Equivalent de compute_adjusted_mean_std (voir nettoyage_donnees.py), calculé pour plusieurs communes à la fois à partir
+    de distributions données par des valeurs (values) et leurs nombres d'occurences (weights).
+    ENTREES :
+        - communes, values, weights (array) : commune, valeur et nombre d'occurences associés à chaque élément
+    SORTIES :
+        - adjusted_mean, adjusted_std (pd.Series indexées par commune)"""
+    def mean_std(keep):
+        w = np.where(keep, weights, 0)
+        n = pd.Series(w).groupby(communes).sum()
+        mean = pd.Series(w * values).groupby(communes).sum() / n
+        with np.errstate(invalid="ignore", divide="ignore"):
+            var = pd.Series(w * (values - mean.reindex(communes).to_numpy())**2).groupby(communes).sum() / (n - 1)
+        return mean.where(n > 0), np.sqrt(var).where(n > 1, 0)  # écart-type nul s'il y a au plus un élément
+
+    mean_avg_notes, std_avg_notes = mean_std(np.ones(len(values), dtype=bool))
+    mean_avg_notes, std_avg_notes = mean_avg_notes.reindex(communes).to_numpy(), std_avg_notes.reindex(communes).to_numpy()
+    adjusted_mean, adjusted_std = mean_std((values >= mean_avg_notes - 2*std_avg_notes) & (values <= mean_avg_notes + 2*std_avg_notes)
+                                           & (values > 1.5) & (values < 5.5))
+    adjusted_std = adjusted_std.where(adjusted_mean + 2*adjusted_std < 5.5, (5.5 - adjusted_mean)/2)
+    adjusted_std = adjusted_std.where(adjusted_mean - 2*adjusted_std > 1.5, (adjusted_mean - 1.5)/2)
+    return adjusted_mean, adjusted_std
+
+
+if __name__ == '__main__':
+    from lecture_ecriture_donnees import iter_file, preview_file
+
+    # simulation du suivi en direct : l'export brut est relu par lots de 5000 réponses
+    insee_refs = preview_file(key="data/converted/2025/brut/220128_BV_Communes_catégories.csv", csv_sep=",", nrows=None)
+    suivi = SuiviEnDirect([f"q{i}" for i in range(7, 34)], insee_refs=insee_refs)
+    for batch in iter_file(key="data/converted/2025/brut/250604_Export_Reponses_Brut_Final_Result 1.csv", chunksize=5000,
+                           csv_sep=","):
+        indicators = suivi.update(batch)
+        alerts = indicators[indicators["Commune évaluée"] & (indicators["filtrage ip"] | indicators["filtrage distribution"])]
+        print(f"{len(indicators)} communes mises à jour, {len(alerts)} alertes :", list(alerts["Nom commune"]))
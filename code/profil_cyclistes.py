@@ -1,6 +1,7 @@
 import pandas as pd
 from lecture_ecriture_donnees import preview_file, make_dir
-from utils import get_commune_name_from_insee, get_insee_code_from_commune_name
+from utils import CommuneRegistry
+from categories_croisement import recode, wide_age_groups
 import matplotlib.pyplot as plt
 from local_paths import your_local_save_fold
 import numpy as np
@@ -164,6 +165,7 @@ def profile_charecteristics(df, question_id, possible_answers, split_question_id
 if __name__ == '__main__':
     pd.set_option('future.no_silent_downcasting', True)
     insee_refs = preview_file(key="data/converted/2025/brut/220128_BV_Communes_catégories.csv", csv_sep=",", nrows=None)
+    registry = CommuneRegistry(insee_refs)
     filtered_data_key = "data/converted/2025/nettoyee/250604_Export_Reponses_Final_Result_Nettoyee.csv"
     df = preview_file(filtered_data_key, nrows=None)
     save_fold = f"{your_local_save_fold}/barometre_profile_genre"
@@ -186,7 +188,7 @@ if __name__ == '__main__':
     # tracé des graphes associés aux violenecs des 10 plus grandes villes de France
     split_question_id = "insee"
     communes = ["Paris", "Marseille", "Lyon", "Toulouse", "Nice", "Nantes", "Montpellier", "Strasbourg", "Bordeaux", "Lille"]
-    split_question_answers = {get_insee_code_from_commune_name(nom_commune, insee_refs)[0]:nom_commune for nom_commune in communes}
+    split_question_answers = {registry.lookup_name(nom_commune)[0]:nom_commune for nom_commune in communes}
     title = "Violences à vélo, 10 plus grandes villes de France"
     profile_charecteristics(df, question_id, poss_answers, split_question_id, split_question_answers, save_fold, title)
 
@@ -196,10 +198,9 @@ if __name__ == '__main__':
     split_question_id = "Catégorie de commune"
 
 
-    different_insees = df["insee"].unique()
-    categories = {insee:get_commune_name_from_insee(insee, insee_refs)[1] for insee in different_insees} # dictionniare qui associe un code insee à la catégorie associée
-    df_categorie[split_question_id] = df_categorie["insee"].apply(lambda insee:categories[insee]) # ajoute une colonne avec la catégorie du baromètre
-                                                                                                    # pour ensuite pouvoir séparer selon cette variable.
+    # ajoute une colonne avec la catégorie du baromètre (une seule jointure sur toute la colonne insee)
+    # pour ensuite pouvoir séparer selon cette variable.
+    df_categorie[split_question_id] = registry.lookup_many(df_categorie["insee"])["Catégorie Baromètre"]
     cat_labels = ['grandes villes', 'villes moyennes', 'communes de banlieue', 'petites villes', 'bourgs et villages']
     split_question_answers = {c:c for c in cat_labels}
     title = "Violences à vélo, par catégories du baromètre"
@@ -255,19 +256,14 @@ if __name__ == '__main__':
     profile_charecteristics(df, question_id, poss_answers, split_question_id, split_question_answers, save_fold, title,
                             nb_answer_on_bar=False)
 
-    # séparation par tranches d'êges élargies
-    def g(x):
-        if x in range(1,4):
-            return 1
-        elif x in range(4,8):
-            return 2
-        else:
-            return 3
+    # séparation par tranches d'êges élargies (voir categories_croisement.py). Les tranches d'âge sont codées ici de 1 à 10
+    # (voir possible_answers), d'où le décalage de 1 par rapport aux codes de 0 à 9 de wide_age_groups. Les réponses
+    # manquantes ou hors des tranches sont comptées avec les seniors
     df_age = df.copy()
-    df_age["new_age_categorie"] = df[questions_id[s_idx]].apply(g)
+    df_age["new_age_categorie"] = recode(df[questions_id[s_idx]], wide_age_groups, offset=1, default='Senior')
     split_question_id = "new_age_categorie"
     title = "Dans quel(s) but(s) utilisez vous le vélo ? (par tranches d'âge élargies)"
-    split_question_answers = {1:"Jeunes (0-18 ans)", 2:"Adultes (18-54 ans)", 3: "Seniors (+54 ans)"}
+    split_question_answers = {'Jeune':"Jeunes (0-18 ans)", 'Adulte':"Adultes (18-54 ans)", 'Senior': "Seniors (+54 ans)"}
     profile_charecteristics(df_age, question_id, poss_answers, split_question_id, split_question_answers, save_fold, title)
 
     # séparation QPV/hors QPV
@@ -325,10 +321,10 @@ if __name__ == '__main__':
 
     # séparation par tranches d'âges élargies
     df_non_cycl_age = df_non_cyclistes.copy()
-    df_non_cycl_age["new_age_categorie"] = df_non_cyclistes["q57"].apply(g)
+    df_non_cycl_age["new_age_categorie"] = recode(df_non_cyclistes["q57"], wide_age_groups, offset=1, default='Senior')
     split_question_id = "new_age_categorie"
     title = "Pour quelles raisons ne faites-vous pas de vélo ? (par tranches d'âge élargies)"
-    split_question_answers = {1: "Jeunes (0-18 ans)", 2: "Adultes (18-54 ans)", 3: "Seniors (+54 ans)"}
+    split_question_answers = {'Jeune': "Jeunes (0-18 ans)", 'Adulte': "Adultes (18-54 ans)", 'Senior': "Seniors (+54 ans)"}
     profile_charecteristics(df_non_cycl_age, question_id, poss_answers, split_question_id, split_question_answers, save_fold,
                             title, nb_split_histo=3)
 
@@ -336,7 +332,8 @@ if __name__ == '__main__':
     df_non_cycl_categorie = df_non_cyclistes.copy()
     split_question_id = "Catégorie de commune"
 
-    df_non_cycl_categorie[split_question_id] = df_categorie["insee"].apply(lambda insee: categories[insee])  # ajoute une colonne avec la catégorie du baromètre
+    # ajoute une colonne avec la catégorie du baromètre (une seule jointure sur toute la colonne insee)
+    df_non_cycl_categorie[split_question_id] = registry.lookup_many(df_non_cycl_categorie["insee"])["Catégorie Baromètre"]
     split_question_answers = {c: c for c in cat_labels}
     title = "Pour quelles raisons ne faites-vous pas de vélo ? (par catégories du baromètre)"
     profile_charecteristics(df_non_cycl_categorie, question_id, poss_answers, split_question_id, split_question_answers,
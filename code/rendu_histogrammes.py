@@ -0,0 +1,240 @@
+import os
+import json
+import numpy as np
+import pandas as pd
+from concurrent.futures import ProcessPoolExecutor
+from scipy.stats import norm
+from matplotlib.figure import Figure
+from matplotlib.backends.backend_agg import FigureCanvasAgg
+from matplotlib.dates import date2num
+
+"""Rendu (différé) des histogrammes des diagnostics du nettoyage des données.
+
+Le nettoyage (filter_data_set, voir nettoyage_donnees.py) ne trace plus de figures : il calcule pour chaque commune inspectée
+des données d'histogramme compactes (effectifs par intervalle des notes moyennes avant et après filtrage, moyenne et
+écart-type ajustés, effectifs par intervalle de temps des réponses et de la plus grande queue de distribution), sauvegardées
+dans le fichier _histogrammes.pkl du dossier des histogrammes. Les figures sont produites ensuite par render_histograms :
+    - format "png" ou "svg" : figures matplotlib. Chaque processus réutilise une seule figure (et un seul canevas Agg) par
+        type d'histogramme, dont seules les données sont mises à jour d'une commune à l'autre. Le format "svg" est vectoriel
+        (sans rastérisation)
+    - format "vega" : spécifications Vega-Lite (fichiers .vl.json, données incluses), écrites sans aucun rendu graphique.
+        Elles s'affichent dans un navigateur (vega-embed) ou dans l'éditeur en ligne de Vega-Lite
+Les figures peuvent être produites en parallèle (workers > 1), et ne sont recalculées que pour les communes dont
+l'empreinte a changé depuis le dernier rendu (fichier _rendu_<format>.pkl)."""
+
+formats = {"png": "png", "svg": "svg", "vega": "vl.json"}  # extension des fichiers de chaque format
+
+
+def get_figure_paths(histogram, fmt="png"):
+    """Chemins des figures d'une commune (trois figures par dossier de sauvegarde)
+    ENTREES :
+        - histogram (dict) : données d'histogramme d'une commune (voir get_commune_diagnostics dans nettoyage_donnees.py)
+        - fmt (str) : format des figures ("png", "svg" ou "vega")
+    SORTIE :
+        paths (list de tuples) : couples (type de figure, chemin), le type valant "avant_filtrage", "après_filtrage" ou
+            "temps_de_reponse" """
+    ext, nom_commune = formats[fmt], histogram["nom_commune"]
+    paths = []
+    for save_fold in histogram["save_folds"]:
+        paths += [("avant_filtrage", f'{save_fold}/histo_avg_notes_{nom_commune}_avant_filtrage.{ext}'),
+                  ("après_filtrage", f'{save_fold}/histo_avg_notes_{nom_commune}_après_filtrage.{ext}'),
+                  ("temps_de_reponse", f'{save_fold}/histo_time_response_{nom_commune}.{ext}')]
+    return paths
+
+
+def get_gaussian(histogram, counts, n_points=1000):
+    """Distribution gaussienne de moyenne et d'écart-type ajustés, à l'échelle des effectifs counts"""
+    bins = histogram["bins"]
+    x = np.linspace(bins[0], bins[-1], n_points)
+    with np.errstate(invalid="ignore", divide="ignore"):
+        y = norm.pdf(x, histogram["adjusted_mean"], histogram["adjusted_std"]) * counts.sum() * (bins[1] - bins[0])
+    return x, y
+
+
+def get_titles(histogram):
+    nom_commune = histogram["nom_commune"]
+    return {"avant_filtrage": f"Distribution de la note moyenne pour la commune {nom_commune} (avant filtrage)",
+            "après_filtrage": f"Distribution de la note moyenne pour la commune {nom_commune} (après filtrage)",
+            "temps_de_reponse": f"Histogramme des dates de réponse {nom_commune} ({histogram['time_step']}h)"}
+
+
+class HistogramRenderer:
+    def __init__(self):
+        """Figures matplotlib réutilisées d'une commune à l'autre : une figure (avec son canevas Agg) pour les notes moyennes,
+        dont les barres, la gaussienne et les lignes verticales sont mises à jour en place, et une figure pour les dates de
+        réponse (le nombre d'intervalles de temps variant d'une commune à l'autre, ses axes sont redessinés)."""
+        self.notes_figure = Figure(figsize=(10, 6))
+        FigureCanvasAgg(self.notes_figure)
+        self.notes_ax = self.notes_figure.add_subplot()
+        self.notes_bins = None
+        self.time_figure = Figure(figsize=(12, 6))
+        FigureCanvasAgg(self.time_figure)
+        self.time_ax = self.time_figure.add_subplot()
+
+    def init_notes_figure(self, bins):
+        ax = self.notes_ax
+        ax.cla()
+        self.notes_bins = bins
+        self.bars = ax.bar(bins[:-1], np.zeros(len(bins) - 1), width=np.diff(bins), align="edge", alpha=0.6,
+                           color='skyblue', edgecolor='black', label='Histogramme des notes')
+        self.gaussian, = ax.plot(bins[[0, -1]], [0, 0], 'r-', label='Distribution gaussienne')
+        self.mean_line = ax.axvline(0, color='black', linestyle='--', linewidth=1.5, label='Moyenne ajustée')
+        self.lower_line = ax.axvline(0, color='gray', linestyle='--', linewidth=1.2, label='-2 écarts-types')
+        self.upper_line = ax.axvline(0, color='gray', linestyle='--', linewidth=1.2, label='+2 écarts-types')
+        ax.set_xlabel("Note moyenne")
+        ax.set_ylabel("Nombre de réponses")
+        ax.legend()
+        ax.grid(True)
+
+    def render_notes(self, histogram, counts, title, save_path):
+        """Trace l'histogramme des notes moyennes (effectifs counts), superposé avec la distribution gaussienne de moyenne et
+        d'écart-type ajustés"""
+        if self.notes_bins is None or not np.array_equal(self.notes_bins, histogram["bins"]):
+            self.init_notes_figure(histogram["bins"])
+        for bar, count in zip(self.bars, counts, strict=True):
+            bar.set_height(count)
+        self.gaussian.set_data(*get_gaussian(histogram, counts))
+        adjusted_mean, adjusted_std = histogram["adjusted_mean"], histogram["adjusted_std"]
+        for line, value in [(self.mean_line, adjusted_mean), (self.lower_line, adjusted_mean - 2*adjusted_std),
+                            (self.upper_line, adjusted_mean + 2*adjusted_std)]:
+            line.set_xdata([value, value])
+        self.notes_ax.set_title(title)
+        self.notes_ax.relim()
+        self.notes_ax.autoscale_view()
+        self.notes_figure.savefig(save_path)
+
+    def render_time(self, histogram, title, save_path):
+        """Trace l'histogramme des dates de réponse (en orange : réponses de la plus grande queue de distribution)"""
+        ax, step = self.time_ax, histogram["time_step"]
+        ax.cla()
+        if len(histogram["time_counts"]) > 0:
+            edges = date2num(pd.date_range(histogram["time_start"], periods=len(histogram["time_counts"]) + 1, freq=f'{step}h'))
+            # barres contiguës sans contour : un seul polygone en escalier par série au lieu d'un rectangle par intervalle
+            ax.stairs(histogram["time_counts"], edges, fill=True, color='C0')
+            ax.stairs(histogram["time_counts_largest_queue"], edges, fill=True, color='orange')
+            ax.xaxis_date()
+        self.time_figure.autofmt_xdate()
+        ax.set_xlabel(f"Date (pas de {step} heures)")
+        ax.set_ylabel("Nombre d'événements")
+        ax.set_title(title)
+        self.time_figure.tight_layout()
+        self.time_figure.savefig(save_path)
+
+    def render(self, histogram, fmt="png"):
+        """Produit les figures d'une commune. SORTIE : paths (list de str) : chemins des fichiers sauvegardés"""
+        titles = get_titles(histogram)
+        paths = []
+        for kind, path in get_figure_paths(histogram, fmt):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            if fmt == "vega":
+                with open(path, "w", encoding="utf-8") as f:
+                    json.dump(get_vega_lite_spec(histogram, kind, titles[kind]), f, ensure_ascii=False)
+            elif kind == "temps_de_reponse":
+                self.render_time(histogram, titles[kind], path)
+            else:
+                counts = histogram["counts_before"] if kind == "avant_filtrage" else histogram["counts_after"]
+                self.render_notes(histogram, counts, titles[kind], path)
+            paths.append(path)
+        return paths
+
+
+def to_json_float(value):
+    """Valeur flottante sérialisable en JSON (None pour NaN ou l'infini)"""
+    return float(value) if np.isfinite(value) else None
+
+
+def get_vega_time_bars(field, color, step):
+    """Couche Vega-Lite des barres de l'histogramme des dates de réponse (colonne field des données, pas de step heures)"""
+    return {"mark": {"type": "bar", "color": color},
+            "encoding": {"x": {"field": "debut", "type": "temporal", "title": f"Date (pas de {step} heures)"},
+                         "x2": {"field": "fin"},
+                         "y": {"field": field, "type": "quantitative", "title": "Nombre d'événements"}}}
+
+
+def get_vega_lite_spec(histogram, kind, title):
+    """Spécification Vega-Lite (dict) d'une figure d'une commune, avec les mêmes éléments que la figure matplotlib"""
+    if kind == "temps_de_reponse":
+        step = histogram["time_step"]
+        lefts = pd.date_range(histogram["time_start"], periods=len(histogram["time_counts"]), freq=f'{step}h')
+        values = [{"debut": left.isoformat(), "fin": (left + pd.Timedelta(hours=step)).isoformat(), "reponses": int(n),
+                   "plus grande queue": int(q)}
+                  for left, n, q in zip(lefts, histogram["time_counts"], histogram["time_counts_largest_queue"], strict=True)]
+        return {"$schema": "https://vega.github.io/schema/vega-lite/v5.json", "title": title, "width": 800, "height": 400,
+                "data": {"values": values}, "layer": [get_vega_time_bars("reponses", "steelblue", step),
+                                                      get_vega_time_bars("plus grande queue", "orange", step)]}
+
+    bins = histogram["bins"]
+    counts = histogram["counts_before"] if kind == "avant_filtrage" else histogram["counts_after"]
+    x, y = get_gaussian(histogram, counts, n_points=200)
+    adjusted_mean, adjusted_std = histogram["adjusted_mean"], histogram["adjusted_std"]
+    return {"$schema": "https://vega.github.io/schema/vega-lite/v5.json", "title": title, "width": 600, "height": 360,
+            "layer": [
+                {"data": {"values": [{"debut": float(a), "fin": float(b), "reponses": int(n)}
+                                     for a, b, n in zip(bins[:-1], bins[1:], counts, strict=True)]},
+                 "mark": {"type": "bar", "color": "skyblue", "opacity": 0.6, "stroke": "black"},
+                 "encoding": {"x": {"field": "debut", "type": "quantitative", "title": "Note moyenne"}, "x2": {"field": "fin"},
+                              "y": {"field": "reponses", "type": "quantitative", "title": "Nombre de réponses"}}},
+                {"data": {"values": [{"note": float(a), "reponses": to_json_float(b)} for a, b in zip(x, y, strict=True)]},
+                 "mark": {"type": "line", "color": "red"},
+                 "encoding": {"x": {"field": "note", "type": "quantitative"}, "y": {"field": "reponses", "type": "quantitative"}}},
+                {"data": {"values": [{"note": to_json_float(v), "ligne": label} for v, label in
+                                     [(adjusted_mean, "Moyenne ajustée"), (adjusted_mean - 2*adjusted_std, "-2 écarts-types"),
+                                      (adjusted_mean + 2*adjusted_std, "+2 écarts-types")]]},
+                 "mark": {"type": "rule", "strokeDash": [6, 4]},
+                 "encoding": {"x": {"field": "note", "type": "quantitative"},
+                              "color": {"field": "ligne", "type": "nominal", "scale": {"range": ["black", "gray", "gray"]}}}}]}
+
+
+worker_renderer = {}  # figures réutilisées par toutes les tâches d'un processus (voir init_render_worker)
+
+
+def init_render_worker(fmt):
+    worker_renderer["renderer"] = HistogramRenderer()
+    worker_renderer["fmt"] = fmt
+
+
+def render_in_worker(histogram):
+    return worker_renderer["renderer"].render(histogram, worker_renderer["fmt"])
+
+
+def render_histograms(histo_save_fold, fmt="png", workers=1, incremental=True, insee=None):
+    """Produit les figures des communes inspectées lors du nettoyage (données d'histogramme du fichier _histogrammes.pkl
+    écrit par filter_data_set).
+    ENTREES :
+        - histo_save_fold (str) : dossier des histogrammes (argument histo_save_fold de filter_data_set)
+        - fmt (str) : format des figures : "png", "svg" (vectoriel) ou "vega" (spécifications Vega-Lite, sans rendu)
+        - workers (int) : nombre de processus. Chaque processus réutilise ses figures d'une commune à l'autre
+        - incremental (bool) : si True, les figures d'une commune ne sont produites que si son empreinte (voir
+            get_communes_fingerprints dans nettoyage_donnees.py) a changé depuis le dernier rendu ou si l'une de ses figures
+            a été supprimée
+        - insee (list, optionnel) : codes insee des communes à produire (toutes les communes inspectées par défaut)
+    SORTIE :
+        paths (list de str) : chemins des fichiers sauvegardés"""
+    histograms = pd.read_pickle(f'{histo_save_fold}/_histogrammes.pkl')
+    if insee is not None:
+        insee = set(insee)
+        histograms = [histogram for histogram in histograms if histogram["insee"] in insee]
+    manifest_path = f'{histo_save_fold}/_rendu_{fmt}.pkl'
+    manifest = pd.read_pickle(manifest_path) if incremental and os.path.exists(manifest_path) else {}
+    to_render = [histogram for histogram in histograms
+                 if manifest.get(histogram["insee"]) != histogram["fingerprint"]
+                 or not all(os.path.exists(path) for _, path in get_figure_paths(histogram, fmt))]
+    print('Nombre de communes à (re)tracer', len(to_render), 'sur', len(histograms))
+    if workers > 1 and len(to_render) > 1:
+        # seules les données d'histogramme (quelques centaines d'octets par commune) sont transmises aux processus
+        with ProcessPoolExecutor(max_workers=workers, initializer=init_render_worker, initargs=(fmt,)) as executor:
+            paths = list(executor.map(render_in_worker, to_render, chunksize=max(1, len(to_render) // (4*workers))))
+    else:
+        renderer = HistogramRenderer()
+        paths = [renderer.render(histogram, fmt) for histogram in to_render]
+    if incremental:
+        manifest.update((histogram["insee"], histogram["fingerprint"]) for histogram in to_render)
+        pd.to_pickle(manifest, manifest_path)
+    return [path for histogram_paths in paths for path in histogram_paths]
+
+
+if __name__ == '__main__':
+    from local_paths import your_local_save_fold
+
+    histogram_save_fold = f"{your_local_save_fold}/histograms_good_data/histograms_2025_potential_frauds"
+    render_histograms(histogram_save_fold, fmt="png", workers=os.cpu_count())
@@ -0,0 +1,51 @@
+import pandas as pd
+
+"""Schémas de types des colonnes des exports du baromètre, pour chaque édition.
+
+Par défaut pandas lit les notes (entiers de 1 à 6, avec des valeurs manquantes) en float64 et les réponses codées en object.
+Les schémas ci-dessous déclarent des types compacts :
+    - notes : entiers nullables sur 1 octet ("Int8")
+    - réponses codées (profil du cycliste) et codes insee : catégories ("category")
+    - date de réponse : datetime64, analysée une seule fois au chargement ("datetime")
+Un schéma s'applique avec apply_schema, ou directement au chargement avec preview_file(..., schema="2025").
+
+Attention : les moyennes de colonnes "Int8" sont de type "Float64" (nullable), et un groupby sur une colonne "category"
+doit être fait avec observed=True pour ne pas produire de groupes vides."""
+
+notes_2025 = [f"q{i}" for i in range(7, 34)]
+profile_answers_2025 = [f"q{i}" for i in range(36, 49)]
+notes_2021 = [f"q{i}" for i in range(14, 41)]
+
+schemas = {
+    "2025": {**{q: "Int8" for q in notes_2025},
+             **{q: "category" for q in profile_answers_2025},
+             "insee": "category",
+             "date": "datetime"},
+    "2021": {**{q: "Int8" for q in notes_2021},
+             "q01": "category",
+             "date": "datetime"},
+}
+
+
+def apply_schema(df, schema):
+    """Convertit les colonnes de df selon schema.
+    ENTREES :
+        - df (pd.DataFrame) : tableau à convertir (les colonnes du schéma absentes du tableau sont ignorées)
+        - schema (str ou dict) : nom d'une édition ("2025", "2021") ou dictionnaire associant des noms de colonnes à des types
+            ("Int8", "category", "datetime" ou tout type accepté par astype)
+    SORTIE :
+        df (pd.DataFrame) : le tableau converti (df est modifié en place)"""
+    schema = schemas[str(schema)] if isinstance(schema, (str, int)) else schema
+    for column, dtype in schema.items():
+        if column not in df.columns:
+            continue
+        if dtype == "datetime":
+            df[column] = pd.to_datetime(df[column], errors="coerce")
+        elif dtype == "Int8":
+            try:
+                df[column] = df[column].astype("Int8")
+            except (TypeError, ValueError):  # valeurs non entières : on se rabat sur des flottants 32 bits
+                df[column] = df[column].astype("float32")
+        else:
+            df[column] = df[column].astype(dtype)
+    return df
@@ -1,3 +1,5 @@
+import numpy as np
+import pandas as pd
 
 
 def get_commune_name_from_insee(insee_code, insee_refs):
@@ -45,4 +47,77 @@ def get_insee_code_from_commune_name(nom_commune, insee_refs):
         insee_code = insee_code.item()
         categorie = categorie.item()
         population = population.item()
-    return insee_code, categorie, population, not_found
\ No newline at end of file
+    return insee_code, categorie, population, not_found
+
+class CommuneRegistry:
+    """Tableau des communes indexé par code INSEE et par nom de commune, construit une seule fois à partir de insee_refs.
+    Contrairement à get_commune_name_from_insee et get_insee_code_from_commune_name, qui parcourent tout le tableau à chaque
+    appel, les recherches d'une commune se font en temps constant (index de hachage) et les recherches sur toute une colonne
+    (lookup_many) se font en une seule jointure.
+    Les codes (ou noms) absents du tableau sont traités comme dans get_commune_name_from_insee : le nom de la commune est le code
+    INSEE, la catégorie vaut 'Not found' et la population 4000 (petite commune)."""
+
+    attributes = ["Commune", "Catégorie Baromètre", "Population", "DEP", "REG", "EPCI"]
+
+    def __init__(self, insee_refs):
+        """ENTREE :
+            insee_refs (pd.DataFrame) : tableau pandas associant les codes INSEE au nom de commune et autres caractéristiques de
+                la commune (en cas de doublon, seule la première ligne associée à un code INSEE ou à un nom est utilisée)"""
+        self.insee_refs = insee_refs
+        self.columns = [c for c in self.attributes if c in insee_refs.columns]
+        self.by_insee = insee_refs.drop_duplicates(subset="INSEE").set_index("INSEE")
+        self.by_name = insee_refs.drop_duplicates(subset="Commune").set_index("Commune")
+        # dictionnaires (recherches en temps constant) des caractéristiques de chaque commune
+        self.insee_records = self.by_insee.to_dict("index")
+        self.name_records = self.by_name.to_dict("index")
+
+    def lookup(self, insee_code, verbose=True):
+        """Equivalent de get_commune_name_from_insee(insee_code, insee_refs), en temps constant. Si verbose vaut False, les codes
+        INSEE non trouvés ne sont pas affichés.
+        SORTIES
+            nom_commune, categorie, population, not_found"""
+        not_found = insee_code not in self.insee_records
+        if not_found:
+            if verbose:
+                print(f"Le numéro INSEE {insee_code} n'a pas été trouvé dans le tableau des communes")
+            return insee_code, 'Not found', 4000, not_found
+        commune = self.insee_records[insee_code]
+        return commune["Commune"], commune["Catégorie Baromètre"], commune["Population"], not_found
+
+    def lookup_name(self, nom_commune, verbose=True):
+        """Equivalent de get_insee_code_from_commune_name(nom_commune, insee_refs), en temps constant.
+        SORTIES
+            insee_code, categorie, population, not_found"""
+        not_found = nom_commune not in self.name_records
+        if not_found:
+            if verbose:
+                print(f"La commune {nom_commune} n'a pas été trouvé dans le tableau des communes")
+            return nom_commune, 'Not found', 4000, not_found
+        commune = self.name_records[nom_commune]
+        return commune["INSEE"], commune["Catégorie Baromètre"], commune["Population"], not_found
+
+    def lookup_many(self, insee_codes, verbose=False):
+        """Recherche de tout un ensemble de codes INSEE (par exemple toute la colonne insee d'un jeu de données) en une seule
+        jointure.
+        ENTREES
+            insee_codes (array ou pd.Series) : codes INSEE à rechercher (avec d'éventuelles répétitions)
+            verbose (bool) : si True, affiche les codes INSEE (distincts) non trouvés
+        SORTIES
+            communes (pd.DataFrame) : une ligne par élément de insee_codes (même index si insee_codes est une pd.Series), avec les
+                colonnes "Commune", "Catégorie Baromètre", "Population", "DEP", "REG", "EPCI" (celles présentes dans insee_refs)
+                et "not_found" """
+        codes = pd.Index(np.asarray(insee_codes, dtype=object))
+        communes = self.by_insee[self.columns].astype(object).reindex(codes)  # jointure sur l'index de hachage des codes INSEE
+        not_found = ~codes.isin(self.by_insee.index)
+        if verbose:
+            for insee_code in pd.unique(codes[not_found]):
+                print(f"Le numéro INSEE {insee_code} n'a pas été trouvé dans le tableau des communes")
+        communes.loc[not_found, "Commune"] = codes[not_found]
+        if "Catégorie Baromètre" in communes.columns:
+            communes.loc[not_found, "Catégorie Baromètre"] = 'Not found'
+        if "Population" in communes.columns:
+            communes.loc[not_found, "Population"] = 4000
+            communes["Population"] = communes["Population"].astype(self.by_insee["Population"].dtype)
+        communes["not_found"] = not_found
+        communes.index = insee_codes.index if isinstance(insee_codes, pd.Series) else pd.RangeIndex(len(codes))
+        return communes
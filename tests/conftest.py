@@ -0,0 +1,5 @@
+import os
+import sys
+
+# les modules du dossier code s'importent les uns les autres par leur nom (ex : from utils import CommuneRegistry)
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "code"))
@@ -0,0 +1,139 @@
+import numpy as np
+import pandas as pd
+import pytest
+from nettoyage_donnees import (analyse_ip, clean_all_communes, detect_response_bursts, filter_one_commune_ip,
+                               filter_one_commune_2025_method, sweep_parameters)
+from utils import CommuneRegistry
+
+
+def get_responses(notes, ips, insee="35238"):
+    """Réponses synthétiques d'une commune : une note moyenne et une adresse ip par réponse"""
+    return pd.DataFrame({"insee": insee, "ip": ips, "average_note": np.asarray(notes, dtype="float64"),
+                         "email": None, "q35": None})
+
+
+def test_analyse_ip_moyenne_limite():
+    """Une adresse ip avec 5 réponses de moyenne exactement 5 (cas limite recalculé avec filter_one_commune_ip)"""
+    df = get_responses([5.0] * 5 + [3.0, 4.0, 2.5], ["1.1.1.1"] * 5 + ["2.2.2.2", "3.3.3.3", "2.2.2.2"])
+    ip_table = analyse_ip(df, "insee", "ip", "q35", "email")
+    _, _, fraudulous_ip, _ = filter_one_commune_ip(df, "ip", "q35", "email", "average_note")
+    assert list(fraudulous_ip) == ["1.1.1.1"]
+    assert set(ip_table.loc[ip_table["ip frauduleuse"], "ip"]) == {"1.1.1.1"}
+    assert set(ip_table["ip"]) == {"1.1.1.1", "2.2.2.2"}
+
+
+def test_detect_response_bursts_date_aberrante():
+    """Une rafale de réponses est détectée malgré une date aberrante (seuls les couples (commune, fenêtre) non vides sont comptés)"""
+    rng = np.random.default_rng(0)
+    dates = pd.Timestamp("2025-03-01") + pd.to_timedelta(rng.integers(0, 60*24*3600, 2000), unit="s")
+    df = pd.DataFrame({"insee": rng.choice(["35238", "29019", "56121"], 2000), "date": dates})
+    burst = pd.DataFrame({"insee": "35238", "date": [pd.Timestamp("2025-03-10 10:00")] * 40})
+    outlier = pd.DataFrame({"insee": "29019", "date": [pd.Timestamp("1970-01-01")]})
+    bursts = detect_response_bursts(pd.concat([df, burst, outlier], ignore_index=True), "insee")
+    assert list(bursts["insee"]) == ["35238"]
+    assert bursts["Début de la fenêtre"].iloc[0] == pd.Timestamp("2025-03-10 00:00")
+    assert bursts["Nombre de réponses"].iloc[0] >= 40
+
+
+def test_filter_one_commune_2025_method_moyenne_ajustee_nan():
+    """Toutes les notes valent 6 : la moyenne ajustée est NaN, les queues sont vides et toutes les réponses sont conservées"""
+    df_commune = get_responses([6.0] * 200, [f"10.0.0.{i}" for i in range(200)])
+    filtered_data, filter, adjusted_mean, _, largest_queue = filter_one_commune_2025_method(df_commune, "Commune")
+    assert np.isnan(adjusted_mean)
+    assert not filter
+    assert len(filtered_data) == 200
+    assert len(largest_queue) == 0
+
+
+def get_communes():
+    """Jeu de données synthétique de plusieurs communes, couvrant les différents cas du nettoyage, et tableau des communes"""
+    rng = np.random.default_rng(1)
+
+    def gaussian(n):
+        return np.clip(rng.normal(3.5, 0.7, n), 1, 6)
+
+    communes = [
+        ("35238", "Rennes", 200000, gaussian(200)),  # pas de filtrage
+        ("29019", "Brest", 140000, np.concatenate([gaussian(200), np.full(40, 6.0)])),  # queue supérieure (cas 2)
+        ("56121", "Lorient", 57000, np.concatenate([gaussian(200), np.full(40, 1.0)])),  # queue inférieure (cas 3)
+        ("22278", "Saint-Brieuc", 44000, np.full(60, 6.0)),  # toutes les notes valent 6 : moyenne ajustée NaN
+        ("29232", "Quimper", 63000, np.full(60, 1.0)),  # toutes les notes valent 1 : moyenne ajustée NaN
+        ("35047", "Bruz", 4500, gaussian(35)),  # petite commune (nb_contribution_min[0])
+        ("35236", "Redon", 9000, gaussian(40)),  # trop peu de contributions : commune non évaluée
+        ("44109", "Nantes", 320000, gaussian(100)),  # adresses ip frauduleuses et moyenne limite
+    ]
+    df = pd.concat([get_responses(notes, [f"10.{i}.0.{j}" for j in range(len(notes))], insee)
+                    for i, (insee, _, _, notes) in enumerate(communes)], ignore_index=True)
+    fraud = pd.concat([get_responses([1.0] * 6, ["6.6.6.6"] * 6, "44109"),  # moyenne <= 2
+                       get_responses([4.6, 5.5, 5.2, 4.5, 5.2], ["5.5.5.5"] * 5, "44109"),  # moyenne 5 ou 4.999999999999999 selon l'ordre
+                       get_responses([5.0] * 5, ["5.5.5.5"] * 5, "29019"),  # moyenne exactement 5
+                       get_responses([3.0, 4.0], [np.nan, np.nan], None),  # commune manquante
+                       get_responses([3.0], ["7.7.7.7"], "99999")])  # commune absente du tableau des communes
+    df = pd.concat([df, fraud], ignore_index=True).sample(frac=1, random_state=0)
+    registry = CommuneRegistry(pd.DataFrame({"INSEE": [insee for insee, _, _, _ in communes],
+                                             "Commune": [nom for _, nom, _, _ in communes],
+                                             "Catégorie Baromètre": "Grandes villes",
+                                             "Population": [population for _, _, population, _ in communes]}))
+    insee_codes = [*df["insee"].dropna().unique()]
+    return df, insee_codes, registry
+
+
+def clean_commune_by_commune(df, insee_codes, registry, nb_contribution_min, **kwargs):
+    """Nettoyage commune par commune (filter_one_commune_ip puis filter_one_commune_2025_method, comme filter_data_set avant
+    clean_all_communes)"""
+    results = {}
+    for insee_code in insee_codes:
+        df_commune = df[df["insee"] == insee_code]
+        nom_commune, _, population, _ = registry.lookup(insee_code, verbose=False)
+        n_min = nb_contribution_min[0] if population <= 5000 else nb_contribution_min[1]
+        if len(df_commune) >= n_min:
+            filtered, _, _, filter_ip = filter_one_commune_ip(df_commune, "ip", "q35", "email", "average_note")
+            filtered, filter_distr, adjusted_mean, _, _ = filter_one_commune_2025_method(filtered, nom_commune, **kwargs)
+            results[insee_code] = (filtered.index, filter_ip, filter_distr, adjusted_mean)
+    return results
+
+
+@pytest.mark.parametrize("communes_to_filter, communes_not_to_filter", [((), ()), (("Rennes",), ("Brest",))])
+def test_clean_all_communes_identique_commune_par_commune(communes_to_filter, communes_not_to_filter):
+    """clean_all_communes donne les mêmes résultats que le nettoyage commune par commune"""
+    df, insee_codes, registry = get_communes()
+    communes, rows = clean_all_communes(df, insee_codes, "insee", "ip", "q35", "email", registry,
+                                        communes_to_filter=communes_to_filter, communes_not_to_filter=communes_not_to_filter)
+    expected = clean_commune_by_commune(df, insee_codes, registry, (30, 50), communes_to_filter=communes_to_filter,
+                                        communes_not_to_filter=communes_not_to_filter)
+    communes = communes.set_index("insee")
+    assert set(communes.index[communes["Commune évaluée"]]) == set(expected)
+    for insee_code, (kept_index, filter_ip, filter_distr, adjusted_mean) in expected.items():
+        commune_rows = rows[rows["commune"] == insee_codes.index(insee_code)]
+        assert sorted(commune_rows.index[commune_rows["conservée"]]) == sorted(kept_index), insee_code
+        assert communes.loc[insee_code, "filtrage ip"] == filter_ip, insee_code
+        assert communes.loc[insee_code, "filtrage distribution"] == filter_distr, insee_code
+        np.testing.assert_equal(communes.loc[insee_code, "Moyenne ajustée"], adjusted_mean)
+    # les cas couverts par le jeu de données
+    assert np.isnan(communes.loc[["22278", "29232"], "Moyenne ajustée"]).all()
+    assert communes.loc["44109", "filtrage ip"] and communes.loc["29019", "filtrage ip"]
+    assert not communes.loc["35236", "Commune évaluée"]
+    assert communes["filtrage distribution"].sum() >= 2
+    assert not rows.loc[df["insee"].isna(), "conservée"].any()
+
+
+@pytest.mark.parametrize("communes_to_filter, communes_not_to_filter", [((), ()), (("Rennes",), ("Brest",))])
+def test_sweep_parameters_identique_clean_all_communes(communes_to_filter, communes_not_to_filter):
+    """Pour un seul jeu de paramètres (celui par défaut), sweep_parameters donne les mêmes comptages que clean_all_communes"""
+    df, insee_codes, registry = get_communes()
+    communes, _ = clean_all_communes(df, insee_codes, "insee", "ip", "q35", "email", registry,
+                                     communes_to_filter=communes_to_filter, communes_not_to_filter=communes_not_to_filter)
+    sweep = sweep_parameters(df, insee_codes, "insee", "ip", "q35", "email", registry,
+                             communes_to_filter=communes_to_filter, communes_not_to_filter=communes_not_to_filter)
+    assert len(sweep) == 1
+    evaluated = communes[communes["Commune évaluée"]]
+    filtered = evaluated["filtrage ip"] | evaluated["filtrage distribution"]
+    n_kept = evaluated["Nombre de contributions après nettoyage"]
+    expected = {"Nombre de communes évaluées": len(evaluated),
+                "Nombre de communes filtrage ip": evaluated["filtrage ip"].sum(),
+                "Nombre de communes filtrage distribution": evaluated["filtrage distribution"].sum(),
+                "Nombre de communes potentiellement frauduleuses": filtered.sum(),
+                "Nombre de communes éliminées après nettoyage": (filtered & ~evaluated["Commune retenue"]).sum(),
+                "Nombre de contributions supprimées": (evaluated["Nombre de contributions avant nettoyage"] - n_kept).sum(),
+                "Nombre de contributions conservées": n_kept[evaluated["Commune retenue"]].sum()}
+    assert sweep.iloc[0][list(expected)].to_dict() == expected
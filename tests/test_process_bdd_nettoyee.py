@@ -0,0 +1,80 @@
+import numpy as np
+import pandas as pd
+from botocore.exceptions import ClientError
+import lecture_ecriture_donnees
+from lecture_ecriture_donnees import serialize_table
+from process_bdd_nettoyee import build_processed, cleaned_key, insee_refs_key, processed_keys, read_inputs
+
+
+def build_processed_baseline(data, insee_refs):
+    """Base traitée telle que la construisait la version d'origine du script process_bdd_nettoyee.py (q7 en double)"""
+    columns_to_keep = ['uid', 'email', 'insee', 'q47', 'q48', 'q4', 'q6', 'q7', 'q29', 'q30', 'q31', 'q32', 'q25', 'q26', 'q27',
+                       'q28', 'q20', 'q21', 'q22', 'q23', 'q24', 'q14', 'q15', 'q16', 'q17', 'q18', 'q19', 'q7', 'q8', 'q9',
+                       'q10', 'q11', 'q12', 'q13', 'q37', 'q45', 'average_note']
+    group_of_questions = {'Services et stationnement': [f"q{i}" for i in range(29, 33)],
+                          'Efforts de la Commune': [f"q{i}" for i in range(25, 29)],
+                          'Confort': [f"q{i}" for i in range(20, 25)],
+                          'Securité': [f"q{i}" for i in range(14, 20)],
+                          'Ressenti général': [f"q{i}" for i in range(7, 14)]}
+    df = data[columns_to_keep].copy()
+    df['q48'] = df['q48'].astype('Int64')
+    df.loc[:, 'age1'] = df['q48'].map({0: '-11 ans', 1: '11-14 ans', 2: '15-18 ans', 3: '18-24 ans', 4: '25-34 ans',
+                                       5: '35-44 ans', 6: '45-54 ans', 7: '54-64 ans', 8: '65-75 ans', 9: '+75 ans'}).astype('string')
+
+    def map_classes(classes):
+        def map_class(x):
+            if pd.isna(x):
+                return np.nan
+            return next((label for low, high, label in classes if low <= x <= high), np.nan)
+        return map_class
+
+    df.loc[:, 'age2'] = df['q48'].apply(map_classes([(0, 2, 'Jeune'), (3, 6, 'Adulte'), (7, 9, 'Senior')]))
+    df['q47'] = df['q47'].astype('Int64')
+    df.loc[:, 'genre'] = df['q47'].map({1: 'F', 2: 'M', 3: 'X'})
+    df.loc[:, 'QPV'] = np.where(df['q4'].isna(), 'Hors QPV', 'Habitant QPV')
+    df['q6'] = df['q6'].astype('Int64')
+    df.loc[:, 'FCC1'] = df['q6'].map({1: 'Tous les jours', 2: '1 à 3 fois par semaine', 3: '1 à 3 fois par mois',
+                                      4: '1 à 3 fois par ans', 5: 'Jamais'}).astype('string')
+    df.loc[:, 'FCC2'] = df['q6'].apply(map_classes([(1, 2, 'Quotidiennement'), (3, 4, 'Ponctuellement'),
+                                                    (5, 5, 'Jamais')])).astype('string')
+    df.loc[:, 'NiveauPratique'] = df['q37'].apply(map_classes([(1, 2, 'Débutant'), (3, 4, 'Intermédiaire'),
+                                                               (5, 6, 'Confirmé')])).astype('string')
+    df.loc[:, 'abonnementTC'] = df['q45'].apply(map_classes([(1, 3, 'Abonné.e TC'), (4, 4, 'Non abonné.e')])).astype('string')
+    for group_name, question_cols in group_of_questions.items():
+        df[group_name] = df[question_cols].mean(axis=1)
+    df['insee'] = df['insee'].astype(str)
+    insee_refs = insee_refs.assign(INSEE=insee_refs['INSEE'].astype(str))
+    return df.merge(insee_refs[['INSEE', 'Commune', 'DEP', 'REG', 'TYPE_COM', 'Catégorie Baromètre', 'EPCI',
+                                'Réponses de cyclistes']], left_on='insee', right_on='INSEE', how='left')
+
+
+def test_base_traitee_identique_version_origine(tmp_path, monkeypatch):
+    """Le CSV de la base traitée publiée (processed_keys) est identique, octet par octet, à celui de la version d'origine"""
+    rng = np.random.default_rng(0)
+    n = 500
+    data = pd.DataFrame({"uid": range(n), "email": "contact@exemple.fr",
+                         "insee": rng.choice([35238, 75056, 69123, 99999], n), "ip": "10.0.0.1",
+                         **{f"q{i}": rng.integers(1, 7, n).astype(float) for i in range(4, 46)},
+                         "average_note": rng.integers(10, 60, n) / 10})
+    data.loc[rng.random(n) < 0.2, ["q4", "q9", "q13", "q37"]] = np.nan
+    data["q48"], data["q47"], data["q6"] = rng.integers(0, 11, n), rng.integers(1, 4, n), rng.integers(1, 6, n)
+    insee_refs = pd.DataFrame({"INSEE": [35238, 75056, 69123], "Commune": ["Rennes", "Paris", "Lyon"], "DEP": [35, 75, 69],
+                               "REG": [53, 11, 84], "TYPE_COM": "COM", "Catégorie Baromètre": "Grandes villes",
+                               "EPCI": [243500139, 200054781, 200046977], "Réponses de cyclistes": [1500, 9000, 3000],
+                               "Population": [220000, 2100000, 520000]})
+    files = {cleaned_key: tmp_path / "nettoyee.csv", insee_refs_key: tmp_path / "communes.csv"}
+    data.to_csv(files[cleaned_key], sep=";", index=False)
+    insee_refs.to_csv(files[insee_refs_key], index=False)
+
+    def get_local_copy(key, bucket_name='fub-s3'):
+        if key not in files:
+            raise ClientError({"Error": {"Code": "404"}}, "HeadObject")
+        return str(files[key])
+
+    monkeypatch.setattr(lecture_ecriture_donnees, "get_local_copy", get_local_copy)
+    monkeypatch.setattr(lecture_ecriture_donnees, "get_s3_client", lambda: None)
+    data, insee_refs = read_inputs()
+    processed, _ = build_processed(data, insee_refs)
+    expected = build_processed_baseline(pd.read_csv(files[cleaned_key], sep=";", engine="python"),
+                                        pd.read_csv(files[insee_refs_key], engine="python"))
+    assert serialize_table(processed, processed_keys[0]) == expected.to_csv(index=False, sep=";").encode("utf-8")